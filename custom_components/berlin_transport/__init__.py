@@ -1,16 +1,37 @@
 """The Berlin (BVG) and Brandenburg (VBB) transport integration."""
+
 from __future__ import annotations
 
+import voluptuous as vol
+
 from homeassistant.core import HomeAssistant
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import Platform
+import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import ConfigType
 
-from .const import DOMAIN, SCAN_INTERVAL  # noqa
+from .const import (  # noqa
+    DOMAIN,
+    SCAN_INTERVAL,
+    CONF_ENDPOINTS,
+    DATA_COORDINATORS,
+    DATA_ENDPOINTS,
+    DATA_RADAR,
+    DATA_TRIPS,
+)
 
 PLATFORMS = [Platform.SENSOR]
 
+CONFIG_SCHEMA = vol.Schema(
+    {
+        vol.Optional(DOMAIN): vol.Schema(
+            {vol.Optional(CONF_ENDPOINTS): vol.All(cv.ensure_list, [cv.url])}
+        )
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up a config entry."""
@@ -21,7 +42,17 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
-    return await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
+    unloaded = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
+    data = hass.data.get(DOMAIN, {})
+    if unloaded and not data.get(DATA_COORDINATORS):
+        # the last sensor is gone, stop probing the endpoints. The pool and
+        # the helpers using it are created again with the next sensor.
+        data.pop(DATA_RADAR, None)
+        data.pop(DATA_TRIPS, None)
+        pool = data.pop(DATA_ENDPOINTS, None)
+        if pool is not None:
+            pool.async_shutdown()
+    return unloaded
 
 
 async def config_entry_update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
@@ -29,7 +60,9 @@ async def config_entry_update_listener(hass: HomeAssistant, entry: ConfigEntry)
     await hass.config_entries.async_reload(entry.entry_id)
 
 
-def setup(
-    hass: HomeAssistant, config: ConfigType  # pylint: disable=unused-argument
-) -> bool:
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Remember the API endpoints, the pool is created on first use."""
+    endpoints = config.get(DOMAIN, {}).get(CONF_ENDPOINTS)
+    if endpoints:
+        hass.data.setdefault(DOMAIN, {})[CONF_ENDPOINTS] = endpoints
     return True
@@ -0,0 +1,155 @@
+"""Response cache for the departures endpoint, shared by all stops."""
+
+from __future__ import annotations
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Mapping
+
+from homeassistant.core import HomeAssistant, callback
+
+from .const import (
+    DOMAIN,
+    CACHE_MAX_AGE,
+    CACHE_MAX_BYTES,
+    CACHE_MAX_ENTRIES,
+    CACHE_TTL,
+    DATA_CACHE,
+)
+
+MAX_AGE_PATTERN = re.compile(r"max-age=(\d+)")
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    etag: str | None
+    last_modified: str | None
+    # size of the response body
+    size: int
+    # monotonic time until which the entry can be used without asking the API
+    fresh_until: float
+    # monotonic time after which the entry is useless and dropped
+    expires_at: float
+
+    def is_fresh(self) -> bool:
+        return time.monotonic() < self.fresh_until
+
+    def validators(self) -> dict[str, str]:
+        """Headers for a conditional request revalidating this entry"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+def freshness(headers: Mapping[str, str]) -> float:
+    """Seconds a response can be reused, its max-age capped to CACHE_MAX_AGE"""
+    cache_control = headers.get("Cache-Control", "")
+    if "no-cache" in cache_control or "no-store" in cache_control:
+        return 0
+    match = MAX_AGE_PATTERN.search(cache_control)
+    if not match:
+        return 0
+    return min(int(match.group(1)), CACHE_MAX_AGE.total_seconds())
+
+
+@callback
+def async_get_cache(hass: HomeAssistant) -> ResponseCache:
+    """Return the cache shared by all coordinators, create it if needed"""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_CACHE not in data:
+        data[DATA_CACHE] = ResponseCache()
+    return data[DATA_CACHE]
+
+
+class ResponseCache:
+    """LRU cache of parsed responses, revalidated with ETag/Last-Modified.
+
+    Keys only repeat if the request params do, so callers must round the
+    `when` param (see StopCoordinator.build_query). Memory is bounded by
+    the number of entries and the summed size of their response bodies.
+    """
+
+    def __init__(
+        self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(url: str, params: Mapping[str, str]) -> str:
+        return url + "?" + "&".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+    def get(self, key: str) -> CacheEntry | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self.remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def hit(self, entry: CacheEntry, headers: Mapping[str, str] | None = None) -> Any:
+        """Count a fresh or revalidated (304) entry as hit and return its value.
+
+        Takes the entry itself: it may have been evicted while it was being
+        revalidated, its value is still what the API confirmed.
+        """
+        if headers is not None:
+            entry.fresh_until = time.monotonic() + freshness(headers)
+        self.hits += 1
+        return entry.value
+
+    def store(
+        self,
+        key: str,
+        value: Any,
+        headers: Mapping[str, str],
+        size: int,
+        ttl: float = CACHE_TTL.total_seconds(),
+    ) -> None:
+        self.misses += 1
+        if key in self.entries:
+            self.remove(key)
+        now = time.monotonic()
+        self.entries[key] = CacheEntry(
+            value=value,
+            etag=headers.get("ETag"),
+            last_modified=headers.get("Last-Modified"),
+            size=size,
+            fresh_until=now + freshness(headers),
+            expires_at=now + min(ttl, CACHE_TTL.total_seconds()),
+        )
+        self.size += size
+        self.evict()
+
+    def remove(self, key: str) -> None:
+        self.size -= self.entries.pop(key).size
+
+    def evict(self) -> None:
+        now = time.monotonic()
+        for key in [
+            key for key, entry in self.entries.items() if entry.expires_at <= now
+        ]:
+            self.remove(key)
+        while self.entries and (
+            len(self.entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            self.remove(next(iter(self.entries)))
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
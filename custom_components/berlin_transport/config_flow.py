@@ -22,12 +22,24 @@ from .const import (
     CONF_DEPARTURES_DIRECTION,
     CONF_DEPARTURES_EXCLUDED_STOPS,
     CONF_DEPARTURES_EXCLUDED_LINES,
+    CONF_DEPARTURES_INCLUDED_LINES,
     CONF_DEPARTURES_DURATION,
+    CONF_DEPARTURES_PARTIAL_RESULTS,
     CONF_DEPARTURES_WALKING_TIME,
     CONF_SHOW_API_LINE_COLORS,
+    CONF_RECORD_DEPARTURES,
+    CONF_SCHEDULE_FALLBACK,
+    CONF_VEHICLE_POSITIONS,
+    CONF_DESTINATION,
+    CONF_MIN_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
+    SCAN_INTERVAL_FLOOR,
     DOMAIN, # noqa
 )
 
+from .endpoints import async_get_endpoints
+from .filters import validate_lines
+from .gtfs import FEED_ERRORS, async_get_stop_index
 from .sensor import TRANSPORT_TYPES_SCHEMA
 
 _LOGGER = logging.getLogger(__name__)
@@ -38,11 +50,23 @@ CONF_FOUND_STOPS = "found_stops"
 DATA_SCHEMA = vol.Schema(
     {
         vol.Optional(CONF_DEPARTURES_DIRECTION): cv.string,
+        vol.Optional(CONF_DEPARTURES_PARTIAL_RESULTS, default=False): cv.boolean,
         vol.Optional(CONF_DEPARTURES_EXCLUDED_STOPS): cv.string,
         vol.Optional(CONF_DEPARTURES_EXCLUDED_LINES): cv.string,
+        vol.Optional(CONF_DEPARTURES_INCLUDED_LINES): cv.string,
         vol.Optional(CONF_DEPARTURES_DURATION): cv.positive_int,
         vol.Optional(CONF_DEPARTURES_WALKING_TIME, default=1): cv.positive_int,
         vol.Optional(CONF_SHOW_API_LINE_COLORS, default=False): cv.boolean,
+        vol.Optional(CONF_RECORD_DEPARTURES, default=True): cv.boolean,
+        vol.Optional(CONF_SCHEDULE_FALLBACK, default=False): cv.boolean,
+        vol.Optional(CONF_VEHICLE_POSITIONS, default=False): cv.boolean,
+        vol.Optional(CONF_DESTINATION): cv.positive_int,
+        vol.Optional(CONF_MIN_SCAN_INTERVAL): vol.All(
+            cv.positive_int, vol.Range(min=SCAN_INTERVAL_FLOOR)
+        ),
+        vol.Optional(CONF_MAX_SCAN_INTERVAL): vol.All(
+            cv.positive_int, vol.Range(min=SCAN_INTERVAL_FLOOR)
+        ),
         **TRANSPORT_TYPES_SCHEMA,
     }
 )
@@ -57,10 +81,10 @@ NAME_SCHEMA = vol.Schema(
 requests.packages.urllib3.util.connection.HAS_IPV6 = False
 
 
-def get_stop_id(name) -> Optional[list[dict[str, Any]]]:
+def get_stop_id(name, endpoint: str = API_ENDPOINT) -> Optional[list[dict[str, Any]]]:
     try:
         response = requests.get(
-            url=f"{API_ENDPOINT}/locations",
+            url=f"{endpoint}/locations",
             params={
                 "query": name,
                 "results": API_MAX_RESULTS,
@@ -68,14 +92,15 @@ def get_stop_id(name) -> Optional[list[dict[str, Any]]]:
             timeout=30,
         )
         response.raise_for_status()
-    except requests.exceptions.HTTPError as ex:
+    except (requests.exceptions.HTTPError, requests.exceptions.ConnectionError) as ex:
         _LOGGER.warning(f"API error: {ex}")
         return []
     except requests.exceptions.Timeout as ex:
         _LOGGER.warning(f"API timeout: {ex}")
         return []
 
-    _LOGGER.debug(f"OK: stops for {name}: {response.text}")
+    # the body is not decoded just for a debug message
+    _LOGGER.debug("OK: stops for %s (%d bytes)", name, len(response.content))
 
     # parse JSON response
     try:
@@ -92,6 +117,18 @@ def get_stop_id(name) -> Optional[list[dict[str, Any]]]:
     ]
 
 
+def validate_details(user_input: dict[str, Any]) -> dict[str, str]:
+    """Form errors of the details, the line filters have to parse"""
+    errors = {}
+    for key in (CONF_DEPARTURES_EXCLUDED_LINES, CONF_DEPARTURES_INCLUDED_LINES):
+        try:
+            validate_lines(user_input.get(key))
+        except vol.Invalid as ex:
+            _LOGGER.debug("Invalid %s: %s", key, ex)
+            errors[key] = "invalid_lines"
+    return errors
+
+
 def list_stops(stops) -> Optional[vol.Schema]:
     """Provides a drop down list of stops"""
     schema = vol.Schema(
@@ -130,16 +167,38 @@ class TransportConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
                 data_schema=NAME_SCHEMA,
                 errors={},
             )
-        self.data[CONF_FOUND_STOPS] = await self.hass.async_add_executor_job(
-            get_stop_id, user_input[CONF_SEARCH]
-        )
+        self.data[CONF_FOUND_STOPS] = await self.async_search_stops(user_input[CONF_SEARCH])
 
         _LOGGER.debug(
-            f"OK: found stops for {user_input[CONF_SEARCH]}: {self.data[CONF_FOUND_STOPS]}"
+            "OK: found stops for %s: %s",
+            user_input[CONF_SEARCH],
+            self.data[CONF_FOUND_STOPS],
         )
 
         return await self.async_step_stop()
 
+    async def async_search_stops(self, name: str) -> list[dict[str, Any]]:
+        """Search the offline stop index of the GTFS feed, the API is only asked
+        when there is no feed, it is broken or nothing was found in it"""
+        try:
+            stop_index = await async_get_stop_index(self.hass)
+        except FEED_ERRORS as ex:
+            _LOGGER.error("Failed to load the stop index, asking the API: %s", ex)
+            stop_index = None
+        if stop_index is not None:
+            stops = await self.hass.async_add_executor_job(
+                stop_index.search, name, API_MAX_RESULTS
+            )
+            if stops:
+                return [
+                    {CONF_DEPARTURES_NAME: stop.name, CONF_DEPARTURES_STOP_ID: stop.id}
+                    for stop in stops
+                ]
+        endpoint = async_get_endpoints(self.hass).candidates()[0]
+        return (
+            await self.hass.async_add_executor_job(get_stop_id, name, endpoint.url) or []
+        )
+
     async def async_step_stop(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
@@ -169,11 +228,14 @@ class TransportConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Handle the details."""
-        if user_input is None:
+        errors = validate_details(user_input) if user_input is not None else {}
+        if user_input is None or errors:
             return self.async_show_form(
                 step_id="details",
-                data_schema=DATA_SCHEMA,
-                errors={},
+                data_schema=self.add_suggested_values_to_schema(
+                    DATA_SCHEMA, user_input or {}
+                ),
+                errors=errors,
             )
 
         data = user_input
@@ -189,8 +251,9 @@ class TransportConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
     ) -> FlowResult:
         """Handle reconfiguration."""
         entry = self._get_reconfigure_entry()
+        errors = validate_details(user_input) if user_input is not None else {}
 
-        if user_input is not None:
+        if user_input is not None and not errors:
             data = user_input
             data[CONF_DEPARTURES_STOP_ID] = entry.data[CONF_DEPARTURES_STOP_ID]
             data[CONF_DEPARTURES_NAME] = entry.data[CONF_DEPARTURES_NAME]
@@ -202,6 +265,7 @@ class TransportConfigFlowHandler(config_entries.ConfigFlow, domain=DOMAIN):
         return self.async_show_form(
             step_id="reconfigure",
             data_schema=self.add_suggested_values_to_schema(
-                DATA_SCHEMA, dict(entry.data)
+                DATA_SCHEMA, user_input or dict(entry.data)
             ),
+            errors=errors,
         )
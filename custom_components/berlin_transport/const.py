@@ -2,22 +2,105 @@ from datetime import timedelta
 
 DOMAIN = "berlin_transport"
 SCAN_INTERVAL = timedelta(seconds=90)
+# sensors poll faster than SCAN_INTERVAL only when they are configured to
+MIN_SCAN_INTERVAL = SCAN_INTERVAL
+# shortest polling interval sensors can be configured to, in seconds
+SCAN_INTERVAL_FLOOR = 30
+MAX_SCAN_INTERVAL = timedelta(minutes=10)
+# poll faster when the next departure is closer than this
+SOON_DEPARTURE_TIME = timedelta(minutes=5)
+# local hours with (almost) no transport, poll as rarely as allowed
+NIGHT_HOURS = range(1, 5)
 FALLBACK_TIME = timedelta(minutes=15)
+# how often the board is re-evaluated locally between polls
+TICK_INTERVAL = timedelta(seconds=10)
+# how often vehicle positions are polled, for sensors tracking them
+RADAR_INTERVAL = timedelta(seconds=30)
+# vehicles are tracked this many degrees (~2 km) around the stops
+RADAR_MARGIN = 0.02
+RADAR_MAX_RESULTS = 256
+# trips are kept this long after their planned end, for delayed vehicles
+TRIP_GRACE = timedelta(hours=1)
+# trips of departures looked up per update of a leave-by sensor
+TRIP_LOOKUPS = 5
+# sensors with a restored board spread their first poll over this time
+STARTUP_STAGGER = timedelta(seconds=30)
 API_ENDPOINT = "https://v6.vbb.transport.rest"
 API_MAX_RESULTS = 15
+API_DEFAULT_DURATION = 10
+# parts of the departures response nothing here reads, and no indentation
+API_LEAN_PARAMS = {
+    "remarks": False,
+    "stopovers": False,
+    "linesOfStops": False,
+    "pretty": False,
+}
+API_TIMEOUT = 30
+# shortest timeout of a request when it is split between several endpoints
+API_MIN_TIMEOUT = 10
+# responses are reused for at most their max-age, and never longer than this
+CACHE_MAX_AGE = timedelta(seconds=60)
+# entries are dropped once their first departure left, or after this anyway
+# since the rounded `when` param moves on every minute
+CACHE_TTL = timedelta(minutes=2)
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 2 * 1024 * 1024
+# requests in flight over all stops
+API_MAX_CONCURRENCY = 4
+# transport.rest allows 100 requests per minute with bursts of 200
+API_RATE_LIMIT = 100 / 60
+API_RATE_BURST = 100
+# how long a host is left alone after a 429 without Retry-After
+API_RATE_LIMITED_PAUSE = timedelta(seconds=60)
+# backoff after errors of a host, doubled on every consecutive error
+API_BACKOFF_BASE = timedelta(seconds=5)
+API_BACKOFF_MAX = timedelta(minutes=10)
+# endpoints get no requests for a while after this many errors in a row
+CIRCUIT_FAILURES = 3
+CIRCUIT_OPEN_TIME = timedelta(minutes=1)
+# with several endpoints, how often their latency and health is checked
+PROBE_INTERVAL = timedelta(minutes=1)
+PROBE_TIMEOUT = timedelta(seconds=5)
+# polls are spread by up to this fraction of the interval
+POLL_JITTER = 0.1
+
+DATA_COORDINATORS = "coordinators"
+DATA_CACHE = "cache"
+DATA_FETCHER = "fetcher"
+DATA_ENDPOINTS = "endpoint_pool"
+DATA_STOP_INDEX = "stop_index"
+DATA_TIMETABLE = "timetable"
+DATA_RADAR = "radar"
+DATA_TRIPS = "trips"
+
+# VBB GTFS feed in the `berlin_transport` folder of the config directory
+GTFS_FEED = "GTFS.zip"
+# timetable built from the feed, see scripts/build_timetable.py
+GTFS_TIMETABLE = "timetable.bin"
+# pause before trying again to load or build a timetable that failed
+TIMETABLE_RETRY = timedelta(minutes=10)
 
 DEFAULT_ICON = "mdi:clock"
 
+CONF_ENDPOINTS = "endpoints"
 CONF_DEPARTURES = "departures"
 CONF_DEPARTURES_NAME = "name"
 CONF_DEPARTURES_STOP_ID = "stop_id"
 CONF_SELECTED_STOP = "selected_stop"
 CONF_DEPARTURES_EXCLUDED_STOPS = "excluded_stops"
 CONF_DEPARTURES_EXCLUDED_LINES = "excluded_lines"
+CONF_DEPARTURES_INCLUDED_LINES = "included_lines"
 CONF_DEPARTURES_WALKING_TIME = "walking_time"
 CONF_DEPARTURES_DIRECTION = "direction"
 CONF_DEPARTURES_DURATION = "duration"
+CONF_DEPARTURES_PARTIAL_RESULTS = "partial_results"
+CONF_MIN_SCAN_INTERVAL = "min_scan_interval"
+CONF_MAX_SCAN_INTERVAL = "max_scan_interval"
 CONF_SHOW_API_LINE_COLORS = "show_official_line_colors"
+CONF_RECORD_DEPARTURES = "record_departures"
+CONF_SCHEDULE_FALLBACK = "schedule_fallback"
+CONF_VEHICLE_POSITIONS = "vehicle_positions"
+CONF_DESTINATION = "destination"
 CONF_TYPE_SUBURBAN = "suburban"
 CONF_TYPE_SUBWAY = "subway"
 CONF_TYPE_TRAM = "tram"
@@ -0,0 +1,483 @@
+"""Shared per-stop departures coordinator."""
+
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+from aiohttp import ClientError, ClientResponseError, ClientTimeout
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+from homeassistant.util import dt as dt_util
+
+from .const import (
+    DOMAIN,
+    SCAN_INTERVAL,
+    MIN_SCAN_INTERVAL,
+    MAX_SCAN_INTERVAL,
+    SOON_DEPARTURE_TIME,
+    NIGHT_HOURS,
+    POLL_JITTER,
+    API_DEFAULT_DURATION,
+    API_LEAN_PARAMS,
+    API_MAX_RESULTS,
+    API_TIMEOUT,
+    API_MIN_TIMEOUT,
+    CONF_DEPARTURES_DIRECTION,
+    CONF_DEPARTURES_DURATION,
+    CONF_DEPARTURES_WALKING_TIME,
+    CONF_MIN_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
+    CONF_SCHEDULE_FALLBACK,
+    DATA_COORDINATORS,
+)
+from .cache import CacheEntry, ResponseCache, async_get_cache
+from .departure import Departure
+from .filters import FilterSpec
+from .endpoints import EndpointPool, async_get_endpoints
+from .fetcher import BackingOff, Fetcher, async_get_fetcher
+from .gtfs import async_get_timetable
+from .metrics import StopMetrics
+from .parser import DeparturesParser
+
+_LOGGER = logging.getLogger(__name__)
+
+READ_CHUNK_SIZE = 16 * 1024
+
+
+def encode_params(params: dict) -> dict[str, str]:
+    """Query params the way requests used to send them: None is dropped,
+    booleans are lowercase strings (aiohttp only accepts str and numbers)"""
+    return {
+        key: str(value).lower() if isinstance(value, bool) else str(value)
+        for key, value in params.items()
+        if value is not None
+    }
+
+
+def split_directions(direction: str | None) -> list[str | None]:
+    """Comma separated directions of a sensor, [None] if it has none"""
+    if direction is None:
+        return [None]
+    directions: list[str | None] = list(direction.split(","))
+    return directions
+
+
+def compute_update_interval(
+    departures: list[Departure],
+    delays_changed: bool,
+    now: datetime,
+    min_interval: timedelta,
+    max_interval: timedelta,
+) -> timedelta:
+    """Poll faster when something is about to leave or delays are moving,
+    back off at night and when the next departure is far away"""
+    upcoming = [d.timestamp for d in departures if d.timestamp >= now]
+    if not upcoming:
+        interval = max_interval
+    elif delays_changed or min(upcoming) - now <= SOON_DEPARTURE_TIME:
+        interval = min_interval
+    elif now.hour in NIGHT_HOURS:
+        interval = max_interval
+    else:
+        # nothing changes on the board until the next departure is close
+        interval = max(SCAN_INTERVAL, (min(upcoming) - now - SOON_DEPARTURE_TIME) / 2)
+    return max(min_interval, min(interval, max_interval))
+
+
+def spread_interval(interval: timedelta) -> timedelta:
+    """Randomize an interval a bit, so stops that started or failed together
+    drift apart instead of polling on the same second forever"""
+    return interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+
+
+@callback
+def async_get_coordinator(hass: HomeAssistant, stop_id: int) -> StopCoordinator:
+    """Return the coordinator shared by all sensors of a stop, create it if needed"""
+    coordinators = hass.data.setdefault(DOMAIN, {}).setdefault(DATA_COORDINATORS, {})
+    if stop_id not in coordinators:
+        coordinators[stop_id] = StopCoordinator(hass, stop_id)
+    return coordinators[stop_id]
+
+
+class StopCoordinator(DataUpdateCoordinator[dict[str | None, list[Departure]]]):
+    """Polls /stops/{id}/departures once for all sensors of the stop.
+
+    The query is the superset of what the subscribed sensors need: every
+    direction any of them uses, all of their transport types, and a time window
+    from the earliest start to the latest end of their windows. The sensors
+    narrow it down locally.
+    """
+
+    def __init__(self, hass: HomeAssistant, stop_id: int) -> None:
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN}_{stop_id}",
+            update_interval=SCAN_INTERVAL,
+        )
+        self.stop_id: int = stop_id
+        self.sensor_configs: dict[str, dict] = {}
+        self.sensor_filters: dict[str, FilterSpec] = {}
+        # directions and params without `when`, planned when sensors change
+        self.query: tuple[list[str | None], dict] | None = None
+        self.failed_directions: set[str | None] = set()
+        # whether data comes from the GTFS timetable because the API is down
+        self.scheduled: bool = False
+        # the planned polling interval, update_interval adds jitter to it
+        self.interval: timedelta = SCAN_INTERVAL
+        self.fetcher: Fetcher = async_get_fetcher(hass)
+        self.endpoints: EndpointPool = async_get_endpoints(hass)
+        self.cache: ResponseCache = async_get_cache(hass)
+        self.metrics = StopMetrics()
+
+    @callback
+    def async_subscribe(
+        self, sensor_id: str, config: dict, filters: FilterSpec
+    ) -> None:
+        self.sensor_configs[sensor_id] = config
+        self.sensor_filters[sensor_id] = filters
+        self.query = None
+
+    @callback
+    def async_unsubscribe(self, sensor_id: str) -> None:
+        self.sensor_configs.pop(sensor_id, None)
+        self.sensor_filters.pop(sensor_id, None)
+        self.query = None
+        if not self.sensor_configs:
+            coordinators = self.hass.data[DOMAIN][DATA_COORDINATORS]
+            if coordinators.get(self.stop_id) is self:
+                del coordinators[self.stop_id]
+
+    def has_directions(self, direction: str | None) -> bool:
+        """Whether the last refresh requested all directions of a sensor"""
+        return self.data is not None and all(
+            d in self.data or d in self.failed_directions
+            for d in split_directions(direction)
+        )
+
+    def interval_bounds(self) -> tuple[timedelta, timedelta]:
+        """The strictest polling bounds of all subscribed sensors"""
+        configs = list(self.sensor_configs.values())
+        min_interval = min(
+            (
+                timedelta(seconds=config[CONF_MIN_SCAN_INTERVAL])
+                for config in configs
+                if config.get(CONF_MIN_SCAN_INTERVAL)
+            ),
+            default=MIN_SCAN_INTERVAL,
+        )
+        max_interval = min(
+            (
+                timedelta(seconds=config[CONF_MAX_SCAN_INTERVAL])
+                for config in configs
+                if config.get(CONF_MAX_SCAN_INTERVAL)
+            ),
+            default=MAX_SCAN_INTERVAL,
+        )
+        return min_interval, max(min_interval, max_interval)
+
+    def delays_changed(self, data: dict[str | None, list[Departure]]) -> bool:
+        if self.data is None:
+            return False
+        previous = {
+            d.key: d.delay for departures in self.data.values() for d in departures
+        }
+        return any(
+            d.key in previous and previous[d.key] != d.delay
+            for departures in data.values()
+            for d in departures
+        )
+
+    def allows(
+        self, stop_id: str | None, line_name: str | None, product: str | None
+    ) -> bool:
+        """Whether any subscribed sensor shows a departure"""
+        return any(
+            filters.allows(stop_id, line_name, product)
+            for filters in self.sensor_filters.values()
+        )
+
+    def wanted(self, source: dict) -> bool:
+        """allows() for an element of the API response"""
+        return any(
+            filters.matches_source(source) for filters in self.sensor_filters.values()
+        )
+
+    def plan_query(self) -> tuple[list[str | None], dict]:
+        """The leanest query covering all subscribed sensors: only the
+        transport types and the time window they show, as many results as
+        they display and none of the response parts Departure doesn't read"""
+        configs = list(self.sensor_configs.values())
+        directions = list(
+            dict.fromkeys(
+                direction
+                for config in configs
+                for direction in split_directions(config.get(CONF_DEPARTURES_DIRECTION))
+            )
+        )
+        # the query starts with the earliest window of the sensors and ends
+        # with the latest, a long walk shifts the window of a sensor
+        windows = [
+            (
+                config.get(CONF_DEPARTURES_WALKING_TIME) or 1,
+                config.get(CONF_DEPARTURES_DURATION) or API_DEFAULT_DURATION,
+            )
+            for config in configs
+        ] or [(1, API_DEFAULT_DURATION)]
+        walking_time = min(walking for walking, _ in windows)
+        duration = max(walking + length for walking, length in windows) - walking_time
+        # transport types any of the sensors shows
+        products: dict[str, bool] = {}
+        for filters in self.sensor_filters.values():
+            for product, shown in filters.product_params().items():
+                products[product] = products.get(product, False) or shown
+        # sensors with the same filters and window show the same departures,
+        # each distinct board needs its own share of the results
+        boards = len(
+            {
+                (
+                    self.sensor_filters[sensor_id].key,
+                    config.get(CONF_DEPARTURES_WALKING_TIME) or 1,
+                    config.get(CONF_DEPARTURES_DURATION) or API_DEFAULT_DURATION,
+                )
+                for sensor_id, config in self.sensor_configs.items()
+            }
+        )
+        params = {
+            "walking_time": walking_time,
+            "duration": duration,
+            "results": API_MAX_RESULTS * max(boards, 1),
+            **products,
+            **API_LEAN_PARAMS,
+        }
+        return directions or [None], params
+
+    def build_query(self) -> tuple[list[str | None], dict]:
+        """Directions and request params of the next refresh"""
+        if self.query is None:
+            self.query = self.plan_query()
+        directions, params = self.query
+        walking_time = params["walking_time"]
+        # the API works in minutes, a rounded `when` lets the cache hit
+        when = datetime.utcnow().replace(second=0, microsecond=0)
+        return directions, {
+            "when": (when + timedelta(minutes=walking_time)).isoformat(),
+            **{key: value for key, value in params.items() if key != "walking_time"},
+        }
+
+    async def _async_update_data(self) -> dict[str | None, list[Departure]]:
+        if not self.sensor_configs:
+            # only diagnostic entities are listening
+            return self.data or {}
+        directions, params = self.build_query()
+        tasks = {
+            direction: asyncio.create_task(
+                self.fetch_directional_departure(direction, params)
+            )
+            for direction in directions
+        }
+        # all directions are fetched at once and share one deadline, so a
+        # slow direction doesn't hold up the others
+        _, pending = await asyncio.wait(tasks.values(), timeout=API_TIMEOUT)
+        for task in pending:
+            _LOGGER.warning(f"API timeout: departures for {self.stop_id}")
+            task.cancel()
+        # cancelled tasks finish on their next turn, results are read after
+        await asyncio.gather(*pending, return_exceptions=True)
+
+        data: dict[str | None, list[Departure]] = {}
+        self.failed_directions = set()
+        # directions no sensor asks for anymore
+        for direction in set(self.metrics.directions).difference(tasks):
+            del self.metrics.directions[direction]
+        for direction, task in tasks.items():
+            departures = None if task in pending else task.result()
+            if departures is None:
+                self.failed_directions.add(direction)
+                if task in pending:
+                    self.metrics.direction(direction).failed("timeout")
+            else:
+                data[direction] = departures
+                self.metrics.direction(direction).succeeded()
+
+        if not data:
+            # retry once the API accepts requests again, its backoff grows
+            # with every consecutive error
+            retry_in = timedelta(
+                seconds=min(
+                    self.fetcher.retry_in(endpoint.url)
+                    for endpoint in self.endpoints.endpoints
+                )
+            )
+            self.interval = max(self.interval_bounds()[0], retry_in)
+            self.update_interval = spread_interval(self.interval)
+            scheduled = await self.async_fetch_scheduled_departures(directions, params)
+            if scheduled is None:
+                raise UpdateFailed(f"Failed to fetch departures for {self.stop_id}")
+            self.scheduled = True
+            return scheduled
+        self.scheduled = False
+        self.metrics.last_success = dt_util.utcnow()
+
+        min_interval, max_interval = self.interval_bounds()
+        self.interval = compute_update_interval(
+            [d for departures in data.values() for d in departures],
+            self.delays_changed(data),
+            dt_util.now(),
+            min_interval,
+            max_interval,
+        )
+        self.update_interval = max(
+            min_interval, min(spread_interval(self.interval), max_interval)
+        )
+        _LOGGER.debug("Departures cache: %s", self.cache.stats())
+        # sensors decide whether they can use a partial result
+        return data
+
+    async def async_fetch_scheduled_departures(
+        self, directions: list[str | None], params: dict
+    ) -> dict[str | None, list[Departure]] | None:
+        """Departures of the GTFS timetable for the same query, if a sensor
+        wants them and the timetable is available"""
+        if not any(
+            config.get(CONF_SCHEDULE_FALLBACK)
+            for config in self.sensor_configs.values()
+        ):
+            return None
+        timetable = async_get_timetable(self.hass)
+        if timetable is None:
+            return None
+        after = datetime.fromisoformat(params["when"]).replace(tzinfo=dt_util.UTC)
+        until = after + timedelta(minutes=params["duration"] or API_DEFAULT_DURATION)
+        data = {}
+        for direction in directions:
+            data[direction] = await self.hass.async_add_executor_job(
+                timetable.departures,
+                self.stop_id,
+                after,
+                until,
+                params["results"],
+                direction,
+                self.allows,
+            )
+        return data
+
+    async def fetch_directional_departure(
+        self, direction: str | None, params: dict
+    ) -> list[Departure] | None:
+        path = f"/stops/{self.stop_id}/departures"
+        params = encode_params({**params, "direction": direction})
+        # responses are filtered while parsing, so the filters are part of
+        # the cached value
+        cache_key = self.cache.key(
+            path,
+            {
+                **params,
+                "filters": ";".join(
+                    sorted(filters.key for filters in self.sensor_filters.values())
+                ),
+            },
+        )
+        metrics = self.metrics.direction(direction)
+        cached = self.cache.get(cache_key)
+        if cached is not None and cached.is_fresh():
+            metrics.cache_hits += 1
+            return self.cache.hit(cached)
+
+        endpoints = self.endpoints.candidates()
+        # a slow endpoint must leave time to fail over to the next one
+        timeout = ClientTimeout(
+            total=max(API_TIMEOUT / len(endpoints), API_MIN_TIMEOUT)
+        )
+        error = "no endpoint"
+        for endpoint in endpoints:
+            started = time.monotonic()
+            try:
+                result = await self.request_departures(
+                    endpoint.url + path, params, cache_key, cached, timeout
+                )
+            except BackingOff as ex:
+                _LOGGER.debug("API skipped: %s", ex)
+                error = str(ex)
+                continue
+            except ClientResponseError as ex:
+                _LOGGER.warning(f"API error: {ex}")
+                error = f"{ex.status} {ex.message}"
+                if ex.status < 500 and ex.status != 429:
+                    # the request itself is wrong, other endpoints won't do better
+                    break
+            except asyncio.TimeoutError:
+                _LOGGER.warning(f"API timeout: {endpoint.url}{path}")
+                error = "timeout"
+            except ClientError as ex:
+                _LOGGER.warning(f"API error: {ex}")
+                error = str(ex) or type(ex).__name__
+            except (ValueError, KeyError, TypeError) as ex:
+                _LOGGER.error(f"API invalid JSON: {ex}")
+                error = f"invalid JSON: {ex}"
+            else:
+                endpoint.succeeded(time.monotonic() - started)
+                return result
+            endpoint.failed(error)
+        metrics.failed(error)
+        return None
+
+    async def request_departures(
+        self,
+        url: str,
+        params: dict[str, str],
+        cache_key: str,
+        cached: CacheEntry | None,
+        timeout: ClientTimeout,
+    ) -> list[Departure]:
+        metrics = self.metrics.direction(params.get("direction"))
+        parser = DeparturesParser(self.wanted)
+        started = time.monotonic()
+        async with self.fetcher.get(
+            url,
+            params=params,
+            headers=cached.validators() if cached is not None else None,
+            timeout=timeout,
+        ) as response:
+            if response.status == 304 and cached is not None:
+                metrics.cache_hits += 1
+                metrics.latency.observe(time.monotonic() - started)
+                return self.cache.hit(cached, response.headers)
+            response.raise_for_status()
+            # departures are built while the response arrives, the
+            # whole document is never held in memory
+            async for chunk in response.content.iter_chunked(READ_CHUNK_SIZE):
+                parser.feed(chunk)
+            result = parser.close()
+
+        metrics.response(
+            latency=time.monotonic() - started,
+            size=parser.size,
+            parse_time=parser.parse_time,
+            received=len(result) + parser.skipped,
+            kept=len(result),
+        )
+        # lazy: the arguments are only formatted when debug logging is on
+        _LOGGER.debug(
+            "OK: %d departures from %s (%d skipped, %d bytes)",
+            len(result),
+            response.url,
+            parser.skipped,
+            parser.size,
+        )
+
+        # the board is outdated once its first departure left
+        now = dt_util.utcnow()
+        first_departure = min((d.timestamp for d in result), default=now)
+        self.cache.store(
+            cache_key,
+            result,
+            response.headers,
+            parser.size,
+            (first_departure - now).total_seconds(),
+        )
+        return result
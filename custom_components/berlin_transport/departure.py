@@ -1,19 +1,55 @@
-from dataclasses import dataclass
-from datetime import datetime
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, tzinfo
 
 from .const import TRANSPORT_TYPE_VISUALS, DEFAULT_ICON
 
+# fromisoformat() creates a new tzinfo for every timestamp, share them instead
+_TIMEZONES: dict[timedelta | None, tzinfo | None] = {}
+# the same goes for the coordinates of the stops
+_STOP_LOCATIONS: dict[tuple[float, float], tuple[float, float]] = {}
 
-@dataclass
+
+def intern(value: str | None) -> str | None:
+    """Line names, directions, products and colors repeat on every poll,
+    keep one copy of each"""
+    return sys.intern(value) if value is not None else None
+
+
+def stop_id_of(stop_id: int | str) -> str:
+    """The 9 digit id of a stop, also for the 12 digit ids of the old API
+    (900000100003 is 900100003)"""
+    stop_id = str(stop_id).strip()
+    if len(stop_id) == 12 and stop_id.startswith("900000"):
+        return "900" + stop_id[6:]
+    return stop_id
+
+
+def stop_location(stop: dict) -> tuple[float, float] | None:
+    location = stop.get("location") or {}
+    if location.get("latitude") is None or location.get("longitude") is None:
+        return None
+    coordinates = (location["latitude"], location["longitude"])
+    return _STOP_LOCATIONS.setdefault(coordinates, coordinates)
+
+
+def parse_time(value: str) -> datetime:
+    timestamp = datetime.fromisoformat(value)
+    return timestamp.replace(
+        tzinfo=_TIMEZONES.setdefault(timestamp.utcoffset(), timestamp.tzinfo)
+    )
+
+
+@dataclass(frozen=True, slots=True, eq=False)
 class Departure:
     """Departure dataclass to store data from API:
     https://v6.vbb.transport.rest/api.html#get-stopsiddepartures"""
 
     trip_id: str
+    stop_id: str | None
     line_name: str
     line_type: str
     timestamp: datetime
-    time: datetime
     direction: str | None = None
     icon: str | None = None
     bg_color: str | None = None
@@ -21,37 +57,114 @@ class Departure:
     location: tuple[float, float] | None = None
     cancelled: bool = False
     delay: int | None = None
+    planned_timestamp: datetime | None = None
+    stop_location: tuple[float, float] | None = None
+    # identity of the stop event, computed once in __post_init__
+    key: tuple = field(init=False, repr=False)
+    key_hash: int = field(init=False, repr=False)
+    # attributes as returned by to_dict(), per (show_api_line_colors, walking_time)
+    attributes: dict | None = field(init=False, repr=False)
+
+    def __post_init__(self):
+        key = (self.trip_id, self.planned_timestamp or self.timestamp, self.stop_id)
+        object.__setattr__(self, "key", key)
+        object.__setattr__(self, "key_hash", hash(key))
+        object.__setattr__(self, "attributes", None)
 
     @classmethod
     def from_dict(cls, source):
-        line_type = source.get("line", {}).get("product")
+        line = source.get("line", {})
+        line_type = line.get("product")
         line_visuals = TRANSPORT_TYPE_VISUALS.get(line_type) or {}
-        timestamp = datetime.fromisoformat(
-            source.get("when") or source.get("plannedWhen")
-        )
+        when = source.get("when")
+        planned_when = source.get("plannedWhen")
+        timestamp = parse_time(when or planned_when)
+        planned_timestamp = None
+        if planned_when:
+            planned_timestamp = (
+                timestamp if planned_when == when else parse_time(planned_when)
+            )
+        position = source.get("currentTripPosition", {})
+        stop = source.get("stop", {})
         return cls(
             trip_id=source["tripId"],
-            line_name=source.get("line", {}).get("name"),
-            line_type=line_type,
+            stop_id=intern(stop.get("id")),
+            line_name=intern(line.get("name")),
+            line_type=intern(line_type),
             timestamp=timestamp,
-            time=timestamp.strftime("%H:%M"),
-            direction=source.get("direction"),
+            direction=intern(source.get("direction")),
             icon=line_visuals.get("icon") or DEFAULT_ICON,
-            bg_color=source.get("line", {}).get("color", {}).get("bg"),
+            bg_color=intern(line.get("color", {}).get("bg")),
             fallback_color=line_visuals.get("color"),
-            location=[
-                source.get("currentTripPosition", {}).get("latitude") or 0.0,
-                source.get("currentTripPosition", {}).get("longitude") or 0.0,
-            ],
+            location=(
+                position.get("latitude") or 0.0,
+                position.get("longitude") or 0.0,
+            ),
             cancelled=source.get("cancelled", False),
             delay=source.get("delay", None),
+            planned_timestamp=planned_timestamp,
+            stop_location=stop_location(stop),
         )
 
+    def as_stored(self) -> dict:
+        """JSON serializable fields, to restore the board after a restart"""
+        return {
+            "trip_id": self.trip_id,
+            "stop_id": self.stop_id,
+            "line_name": self.line_name,
+            "line_type": self.line_type,
+            "timestamp": self.timestamp.isoformat(),
+            "direction": self.direction,
+            "icon": self.icon,
+            "bg_color": self.bg_color,
+            "fallback_color": self.fallback_color,
+            "location": list(self.location) if self.location else None,
+            "cancelled": self.cancelled,
+            "delay": self.delay,
+            "planned_timestamp": (
+                self.planned_timestamp.isoformat() if self.planned_timestamp else None
+            ),
+            "stop_location": list(self.stop_location) if self.stop_location else None,
+        }
+
+    @classmethod
+    def from_stored(cls, stored: dict):
+        planned = stored.get("planned_timestamp")
+        location = stored.get("location")
+        stop = stored.get("stop_location")
+        return cls(
+            trip_id=stored["trip_id"],
+            stop_id=intern(stored.get("stop_id")),
+            line_name=sys.intern(stored["line_name"] or ""),
+            line_type=sys.intern(stored["line_type"] or ""),
+            timestamp=parse_time(stored["timestamp"]),
+            direction=intern(stored.get("direction")),
+            icon=stored.get("icon"),
+            bg_color=intern(stored.get("bg_color")),
+            fallback_color=stored.get("fallback_color"),
+            location=tuple(location) if location else None,
+            cancelled=stored.get("cancelled", False),
+            delay=stored.get("delay"),
+            planned_timestamp=parse_time(planned) if planned else None,
+            stop_location=tuple(stop) if stop else None,
+        )
+
+    @property
+    def time(self) -> str:
+        return self.timestamp.strftime("%H:%M")
+
     def to_dict(self, show_api_line_colors: bool, walking_time: int):
+        # departures are immutable, so the attributes are built only once
+        cache_key = (show_api_line_colors, walking_time)
+        if self.attributes is None:
+            object.__setattr__(self, "attributes", {})
+        elif cache_key in self.attributes:
+            return self.attributes[cache_key]
+
         color = self.fallback_color
         if show_api_line_colors and self.bg_color is not None:
             color = self.bg_color
-        return {
+        attributes = self.attributes[cache_key] = {  # type: ignore[index]
             "line_name": self.line_name,
             "line_type": self.line_type,
             "time": self.time,
@@ -62,14 +175,14 @@ class Departure:
             "delay": self.delay,
             "walking_time": walking_time,
         }
+        return attributes
+
+    # The same stop event can be returned for several directions (e.g. the
+    # Ringbahn), it is identified by trip, planned time and stop
+    def __eq__(self, other):
+        if not isinstance(other, Departure):
+            return NotImplemented
+        return self.key_hash == other.key_hash and self.key == other.key
 
-    # Make the object hashable and use all infos that can be displayed in the
-    # frontend
     def __hash__(self):
-        # The value of colors and walking time doesn't matter, it just needs to
-        # be the same for all evaluations of this function
-        items = self.to_dict(show_api_line_colors=False, walking_time=0).items()
-        # Dictionaries are not hashable, so use the items, sort them for
-        # reproducibility. Convert it to a tuple, since lists are also not
-        # hashable
-        return hash(tuple(sorted(items)))
+        return self.key_hash
@@ -0,0 +1,51 @@
+"""Diagnostics support for the Berlin (BVG) and Brandenburg (VBB) transport integration."""
+
+from __future__ import annotations
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .cache import async_get_cache
+from .endpoints import async_get_endpoints
+from .fetcher import async_get_fetcher
+from .trips import async_get_trips
+from .const import DOMAIN, CONF_DEPARTURES_STOP_ID, DATA_COORDINATORS, DATA_RADAR
+
+# vehicles this close to the stop are listed
+NEARBY_RADIUS = 1000
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, entry: ConfigEntry
+) -> dict[str, Any]:
+    coordinator = (
+        hass.data.get(DOMAIN, {})
+        .get(DATA_COORDINATORS, {})
+        .get(entry.data[CONF_DEPARTURES_STOP_ID])
+    )
+    stop: dict[str, Any] = {}
+    if coordinator is not None:
+        stop = {
+            "sensors": len(coordinator.sensor_configs),
+            "last_update_success": coordinator.last_update_success,
+            "update_interval": coordinator.update_interval.total_seconds(),
+            "failed_directions": sorted(map(str, coordinator.failed_directions)),
+            "metrics": coordinator.metrics.as_dict(),
+        }
+    radar = hass.data.get(DOMAIN, {}).get(DATA_RADAR)
+    if radar is not None:
+        nearby = radar.vehicles_near(entry.data[CONF_DEPARTURES_STOP_ID], NEARBY_RADIUS)
+        stop["vehicles_nearby"] = [
+            {"trip_id": v.trip_id, "line": v.line_name, "direction": v.direction}
+            for v in nearby
+        ]
+    return {
+        "config": dict(entry.data),
+        "stop": stop,
+        "cache": async_get_cache(hass).stats(),
+        "requests": async_get_fetcher(hass).stats(),
+        "endpoints": async_get_endpoints(hass).as_dict(),
+        "radar": radar.as_dict() if radar is not None else None,
+        "trips": async_get_trips(hass).stats(),
+    }
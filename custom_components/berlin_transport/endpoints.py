@@ -0,0 +1,166 @@
+"""Pool of API endpoints with health probing and circuit breaking."""
+
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any
+
+from aiohttp import ClientError, ClientTimeout
+
+from homeassistant.core import CALLBACK_TYPE, HomeAssistant, callback
+from homeassistant.helpers.event import async_track_time_interval
+
+from .const import (
+    DOMAIN,
+    API_ENDPOINT,
+    CIRCUIT_FAILURES,
+    CIRCUIT_OPEN_TIME,
+    CONF_ENDPOINTS,
+    DATA_ENDPOINTS,
+    PROBE_INTERVAL,
+    PROBE_TIMEOUT,
+)
+from .fetcher import BackingOff, async_get_fetcher
+
+_LOGGER = logging.getLogger(__name__)
+
+# cheap request every hafas-rest-api instance answers
+PROBE_PATH = "/locations"
+PROBE_PARAMS = {"query": "Alexanderplatz", "results": "1"}
+# weight of the newest measurement in the latency average
+LATENCY_WEIGHT = 0.3
+
+
+@callback
+def async_get_endpoints(hass: HomeAssistant) -> EndpointPool:
+    """Return the endpoint pool shared by all coordinators, create it if needed.
+
+    The endpoints come from the `berlin_transport:` section of
+    configuration.yaml, see async_setup().
+    """
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_ENDPOINTS not in data:
+        data[DATA_ENDPOINTS] = EndpointPool(
+            hass, data.get(CONF_ENDPOINTS) or [API_ENDPOINT]
+        )
+    return data[DATA_ENDPOINTS]
+
+
+class Endpoint:
+    """An API base url and its circuit breaker.
+
+    The circuit opens after CIRCUIT_FAILURES consecutive failures and the
+    endpoint gets no requests for CIRCUIT_OPEN_TIME. After that it is
+    half-open: the next request (or probe) decides whether it closes again.
+    """
+
+    def __init__(self, url: str, priority: int) -> None:
+        self.url = url.rstrip("/")
+        self.priority = priority
+        # moving average of the response time in seconds, None until measured
+        self.latency: float | None = None
+        self.failures = 0
+        self.opened_until = 0.0
+        self.last_error: str | None = None
+
+    @property
+    def closed(self) -> bool:
+        return self.failures < CIRCUIT_FAILURES
+
+    @property
+    def usable(self) -> bool:
+        """Closed, or half-open and allowed to try again"""
+        return self.closed or time.monotonic() >= self.opened_until
+
+    def succeeded(self, latency: float) -> None:
+        if not self.closed:
+            _LOGGER.info(f"API endpoint {self.url} is back")
+        self.failures = 0
+        self.last_error = None
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+
+    def failed(self, error: str) -> None:
+        self.failures += 1
+        self.last_error = error
+        if not self.closed:
+            if self.failures == CIRCUIT_FAILURES:
+                _LOGGER.warning(f"API endpoint {self.url} is failing: {error}")
+            self.opened_until = time.monotonic() + CIRCUIT_OPEN_TIME.total_seconds()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "url": self.url,
+            "latency": self.latency,
+            "failures": self.failures,
+            "circuit": "closed" if self.closed else "open",
+            "last_error": self.last_error,
+        }
+
+
+class EndpointPool:
+    """Routes requests to the fastest healthy endpoint.
+
+    With more than one endpoint, every endpoint is probed in the background
+    so the latency ranking stays current and open circuits get their trial
+    request without waiting for a poll.
+    """
+
+    def __init__(self, hass: HomeAssistant, urls: list[str]) -> None:
+        self.hass = hass
+        self.endpoints = [Endpoint(url, i) for i, url in enumerate(urls)]
+        self.unsub_probe: CALLBACK_TYPE | None = None
+        if len(self.endpoints) > 1:
+            self.unsub_probe = async_track_time_interval(
+                hass, self.async_probe, PROBE_INTERVAL
+            )
+            hass.async_create_task(self.async_probe())
+
+    @callback
+    def async_shutdown(self) -> None:
+        """Stop the background probes"""
+        if self.unsub_probe is not None:
+            self.unsub_probe()
+            self.unsub_probe = None
+
+    def candidates(self) -> list[Endpoint]:
+        """Endpoints to try in order: usable ones by latency (unmeasured ones
+        in configured order), then the open ones as last resort"""
+        usable = sorted(
+            (e for e in self.endpoints if e.usable),
+            key=lambda e: (e.latency is None, e.latency or 0, e.priority),
+        )
+        if usable:
+            return usable
+        return sorted(self.endpoints, key=lambda e: e.opened_until)
+
+    async def async_probe(self, _: datetime | None = None) -> None:
+        await asyncio.gather(
+            *(self.async_probe_endpoint(e) for e in self.endpoints if e.usable)
+        )
+
+    async def async_probe_endpoint(self, endpoint: Endpoint) -> None:
+        fetcher = async_get_fetcher(self.hass)
+        started = time.monotonic()
+        try:
+            async with fetcher.get(
+                endpoint.url + PROBE_PATH,
+                params=PROBE_PARAMS,
+                timeout=ClientTimeout(total=PROBE_TIMEOUT.total_seconds()),
+            ) as response:
+                response.raise_for_status()
+                await response.read()
+        except BackingOff:
+            # the host is known to be failing already
+            return
+        except (ClientError, asyncio.TimeoutError) as ex:
+            endpoint.failed(f"probe: {str(ex) or type(ex).__name__}")
+            return
+        endpoint.succeeded(time.monotonic() - started)
+
+    def as_dict(self) -> list[dict[str, Any]]:
+        return [endpoint.as_dict() for endpoint in self.endpoints]
@@ -0,0 +1,211 @@
+"""Request pipeline of the integration, shared by all stops."""
+
+from __future__ import annotations
+import asyncio
+import logging
+import random
+import time
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Mapping
+
+from aiohttp import ClientError, ClientResponse, ClientResponseError, ClientSession
+from yarl import URL
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.aiohttp_client import async_get_clientsession
+
+from .const import (
+    DOMAIN,
+    API_BACKOFF_BASE,
+    API_BACKOFF_MAX,
+    API_MAX_CONCURRENCY,
+    API_RATE_BURST,
+    API_RATE_LIMIT,
+    API_RATE_LIMITED_PAUSE,
+    DATA_FETCHER,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class BackingOff(ClientError):
+    """Raised instead of sending a request to a host that is backing off"""
+
+    def __init__(self, host: str, seconds: float) -> None:
+        super().__init__(f"{host} is backing off for another {seconds:.0f}s")
+        self.seconds = seconds
+
+
+def backoff_delay(failures: int) -> float:
+    """Exponential backoff with equal jitter: hosts failing at the same time
+    don't retry at the same time"""
+    delay = min(
+        API_BACKOFF_MAX.total_seconds(),
+        API_BACKOFF_BASE.total_seconds() * 2 ** (failures - 1),
+    )
+    return random.uniform(delay / 2, delay)
+
+
+def retry_after(headers: Mapping[str, str]) -> float | None:
+    """Seconds from the Retry-After header, given in seconds or as HTTP date"""
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+@callback
+def async_get_fetcher(hass: HomeAssistant) -> Fetcher:
+    """Return the fetcher shared by all coordinators, create it if needed"""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_FETCHER not in data:
+        # shared aiohttp session of HA, pools and keeps alive the connections
+        data[DATA_FETCHER] = Fetcher(async_get_clientsession(hass))
+    return data[DATA_FETCHER]
+
+
+class HostLimiter:
+    """Token bucket of a host, paused while the host backs off after errors"""
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        # consecutive 429, 5xx and connection errors
+        self.failures = 0
+        # waiters are served in order
+        self.lock = asyncio.Lock()
+
+    def retry_in(self) -> float:
+        return max(0.0, self.paused_until - time.monotonic())
+
+    async def acquire(self, host: str) -> None:
+        async with self.lock:
+            while True:
+                if self.retry_in() > 0:
+                    # fail fast, the coordinators retry after the backoff
+                    raise BackingOff(host, self.retry_in())
+                now = time.monotonic()
+                self.tokens = min(
+                    self.burst, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def succeeded(self) -> None:
+        self.failures = 0
+
+    def failed(self, pause_for: float | None = None) -> float:
+        """Back off, at least as long as the host asked to"""
+        self.failures += 1
+        pause = max(backoff_delay(self.failures), pause_for or 0)
+        self.paused_until = max(self.paused_until, time.monotonic() + pause)
+        return pause
+
+
+class Fetcher:
+    """Runs the requests of all stops through one session.
+
+    Coordinators poll on their own schedule, the fetcher keeps the sum of
+    their requests within a global concurrency limit and the rate limit of
+    each host, so 30 stops refreshing together queue up instead of bursting.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        max_concurrency: int = API_MAX_CONCURRENCY,
+        rate: float = API_RATE_LIMIT,
+        burst: int = API_RATE_BURST,
+    ) -> None:
+        self.session = session
+        self.rate = rate
+        self.burst = burst
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.hosts: dict[str, HostLimiter] = {}
+        self.requests = 0
+        self.in_flight = 0
+        self.rate_limited = 0
+
+    def host(self, url: str) -> HostLimiter:
+        host = URL(url).host or ""
+        if host not in self.hosts:
+            self.hosts[host] = HostLimiter(self.rate, self.burst)
+        return self.hosts[host]
+
+    def retry_in(self, url: str) -> float:
+        """Seconds until the host of the url accepts requests again"""
+        return self.host(url).retry_in()
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs: Any) -> AsyncIterator[ClientResponse]:
+        """session.get() once the host and the concurrency limit allow it.
+
+        Raises BackingOff while the host backs off after 429, 5xx or
+        connection errors.
+        """
+        host = URL(url).host or ""
+        limiter = self.host(url)
+        await limiter.acquire(host)
+        async with self.semaphore:
+            self.requests += 1
+            self.in_flight += 1
+            backing_off = False
+            try:
+                async with self.session.get(url, **kwargs) as response:
+                    if response.status == 429:
+                        self.rate_limited += 1
+                        backing_off = True
+                        pause = retry_after(response.headers)
+                        if pause is None:
+                            pause = API_RATE_LIMITED_PAUSE.total_seconds()
+                        pause = limiter.failed(pause)
+                        _LOGGER.warning(f"Rate limited by {host}, pausing {pause:.0f}s")
+                    elif response.status >= 500:
+                        backing_off = True
+                        pause = limiter.failed(retry_after(response.headers))
+                        _LOGGER.debug(
+                            "%s answered %d, pausing %.0fs",
+                            host,
+                            response.status,
+                            pause,
+                        )
+                    else:
+                        limiter.succeeded()
+                    yield response
+            except (ClientError, asyncio.TimeoutError) as ex:
+                # connection errors and timeouts, status errors are handled above
+                if not backing_off and not isinstance(ex, ClientResponseError):
+                    limiter.failed()
+                raise
+            finally:
+                self.in_flight -= 1
+
+    def stats(self) -> dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "in_flight": self.in_flight,
+            "backing_off": {
+                host: {
+                    "seconds": round(limiter.paused_until - now),
+                    "failures": limiter.failures,
+                }
+                for host, limiter in self.hosts.items()
+                if limiter.paused_until > now
+            },
+        }
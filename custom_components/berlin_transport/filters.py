@@ -0,0 +1,163 @@
+"""Departure filters of a sensor, compiled once from its config."""
+
+from __future__ import annotations
+import fnmatch
+import re
+from dataclasses import dataclass, field
+
+import voluptuous as vol
+
+from .const import (
+    CONF_DEPARTURES_EXCLUDED_LINES,
+    CONF_DEPARTURES_EXCLUDED_STOPS,
+    CONF_DEPARTURES_INCLUDED_LINES,
+    TRANSPORT_TYPE_VISUALS,
+)
+from .departure import Departure
+
+GLOB_CHARACTERS = re.compile(r"[*?\[]")
+
+
+def split_list(value: str | None) -> list[str]:
+    """Comma separated config value, without blanks"""
+    if not value:
+        return []
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def join_patterns(patterns: list[str]) -> re.Pattern | None:
+    """One regular expression matching any of the patterns"""
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+
+@dataclass(frozen=True)
+class LineMatcher:
+    """Line names from a comma separated list: exact names (`M10`), globs
+    (`N*`, `S4?`) and regular expressions between slashes (`/^X\\d+$/`).
+
+    A glob has to match the whole name, a regular expression anywhere in it
+    unless it's anchored.
+    """
+
+    names: frozenset[str] = frozenset()
+    glob: re.Pattern | None = None
+    pattern: re.Pattern | None = None
+
+    @classmethod
+    def parse(cls, value: str | None) -> LineMatcher:
+        names = set()
+        globs = []
+        patterns = []
+        for item in split_list(value):
+            if len(item) > 2 and item.startswith("/") and item.endswith("/"):
+                patterns.append(item[1:-1])
+            elif GLOB_CHARACTERS.search(item):
+                globs.append(fnmatch.translate(item))
+            else:
+                names.add(item)
+        return cls(frozenset(names), join_patterns(globs), join_patterns(patterns))
+
+    def __bool__(self) -> bool:
+        return bool(self.names) or self.glob is not None or self.pattern is not None
+
+    def matches(self, name: str | None) -> bool:
+        if name is None:
+            return False
+        if name in self.names:
+            return True
+        if self.glob is not None and self.glob.fullmatch(name) is not None:
+            return True
+        return self.pattern is not None and self.pattern.search(name) is not None
+
+
+def validate_lines(value: str | None) -> str | None:
+    """Config validator of a line filter, its regular expressions have to
+    compile"""
+    try:
+        LineMatcher.parse(value)
+    except re.error as ex:
+        raise vol.Invalid(f"invalid regular expression in {value!r}: {ex}") from ex
+    return value
+
+
+@dataclass(frozen=True)
+class FilterSpec:
+    """Which departures a sensor shows, apart from the time window.
+
+    Built once per sensor. Line patterns are evaluated once per line name,
+    after that every check is a set lookup.
+    """
+
+    excluded_stops: frozenset[str] = frozenset()
+    excluded_lines: LineMatcher = LineMatcher()
+    included_lines: LineMatcher = LineMatcher()
+    # transport types the sensor doesn't show
+    excluded_products: frozenset[str] = frozenset()
+    # identifies equal filters, e.g. in cache keys
+    key: str = ""
+    _lines: dict[str | None, bool] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
+
+    @classmethod
+    def from_config(cls, config: dict) -> FilterSpec:
+        excluded_products = frozenset(
+            product for product in TRANSPORT_TYPE_VISUALS if not config.get(product)
+        )
+        key = "|".join(
+            [
+                config.get(CONF_DEPARTURES_EXCLUDED_STOPS) or "",
+                config.get(CONF_DEPARTURES_EXCLUDED_LINES) or "",
+                config.get(CONF_DEPARTURES_INCLUDED_LINES) or "",
+                ",".join(sorted(excluded_products)),
+            ]
+        )
+        return cls(
+            excluded_stops=frozenset(
+                split_list(config.get(CONF_DEPARTURES_EXCLUDED_STOPS))
+            ),
+            excluded_lines=LineMatcher.parse(
+                config.get(CONF_DEPARTURES_EXCLUDED_LINES)
+            ),
+            included_lines=LineMatcher.parse(
+                config.get(CONF_DEPARTURES_INCLUDED_LINES)
+            ),
+            excluded_products=excluded_products,
+            key=key,
+        )
+
+    def product_params(self) -> dict[str, bool]:
+        """Transport type params of the departures endpoint"""
+        return {
+            product: product not in self.excluded_products
+            for product in TRANSPORT_TYPE_VISUALS
+        }
+
+    def line_allowed(self, name: str | None) -> bool:
+        allowed = self._lines.get(name)
+        if allowed is None:
+            allowed = self._lines[name] = not self.excluded_lines.matches(name) and (
+                not self.included_lines or self.included_lines.matches(name)
+            )
+        return allowed
+
+    def allows(
+        self, stop_id: str | None, line_name: str | None, product: str | None
+    ) -> bool:
+        return (
+            stop_id not in self.excluded_stops
+            and product not in self.excluded_products
+            and self.line_allowed(line_name)
+        )
+
+    def matches(self, departure: Departure) -> bool:
+        return self.allows(departure.stop_id, departure.line_name, departure.line_type)
+
+    def matches_source(self, source: dict) -> bool:
+        """matches() for an element of the API response"""
+        line = source.get("line") or {}
+        return self.allows(
+            (source.get("stop") or {}).get("id"), line.get("name"), line.get("product")
+        )
@@ -0,0 +1,665 @@
+"""Offline data from the VBB GTFS feed: https://www.vbb.de/vbbgtfs
+
+The feed is read from `berlin_transport/GTFS.zip` in the Home Assistant config
+directory. Nothing is downloaded, without the feed the integration only uses
+the live API. It provides the stop search of the config flow and the
+timetable used when the API is down.
+"""
+
+from __future__ import annotations
+import asyncio
+import bisect
+import csv
+import difflib
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import sys
+import unicodedata
+import zipfile
+from array import array
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import BinaryIO, Callable, Iterator, Literal, NamedTuple
+from zoneinfo import ZoneInfo
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.storage import STORAGE_DIR
+
+from .const import (
+    DOMAIN,
+    TIMETABLE_RETRY,
+    CONF_TYPE_BUS,
+    CONF_TYPE_EXPRESS,
+    CONF_TYPE_FERRY,
+    CONF_TYPE_REGIONAL,
+    CONF_TYPE_SUBURBAN,
+    CONF_TYPE_SUBWAY,
+    CONF_TYPE_TRAM,
+    DATA_STOP_INDEX,
+    DATA_TIMETABLE,
+    DEFAULT_ICON,
+    GTFS_FEED,
+    GTFS_TIMETABLE,
+    TRANSPORT_TYPE_VISUALS,
+)
+from .departure import Departure, intern, stop_id_of
+
+_LOGGER = logging.getLogger(__name__)
+
+GTFS_TIMEZONE = ZoneInfo("Europe/Berlin")
+# what a missing, truncated or unexpected feed or index file raises
+FEED_ERRORS = (OSError, ValueError, KeyError, TypeError, csv.Error, zipfile.BadZipFile)
+TIMETABLE_MAGIC = b"BTT1"
+# magic, number of stops, stop times, trips and routes, size of the metadata
+TIMETABLE_HEADER = struct.Struct("<4sIIIII")
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+# GTFS route types (basic and extended) used by VBB
+ROUTE_TYPE_PRODUCTS = {
+    0: CONF_TYPE_TRAM,
+    1: CONF_TYPE_SUBWAY,
+    2: CONF_TYPE_REGIONAL,
+    3: CONF_TYPE_BUS,
+    4: CONF_TYPE_FERRY,
+    100: CONF_TYPE_REGIONAL,
+    101: CONF_TYPE_EXPRESS,
+    102: CONF_TYPE_EXPRESS,
+    103: CONF_TYPE_REGIONAL,
+    106: CONF_TYPE_REGIONAL,
+    109: CONF_TYPE_SUBURBAN,
+    400: CONF_TYPE_SUBWAY,
+    900: CONF_TYPE_TRAM,
+    1000: CONF_TYPE_FERRY,
+    1200: CONF_TYPE_FERRY,
+}
+
+
+def route_type_product(route_type: int) -> str | None:
+    if 700 <= route_type < 800:
+        return CONF_TYPE_BUS
+    return ROUTE_TYPE_PRODUCTS.get(route_type)
+
+
+def api_stop_id(gtfs_stop_id: str) -> str:
+    """The API uses the station part of VBB's IFOPT ids (de:11000:900100003::1)"""
+    parts = gtfs_stop_id.split(":")
+    return parts[2] if len(parts) > 2 else gtfs_stop_id
+
+
+def normalize(text: str) -> str:
+    """Lowercase, without accents and punctuation: 'S+U Schönhauser Allee'
+    becomes 's u schonhauser allee'"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.split(r"[^0-9a-z]+", text)).strip()
+
+
+class Stop(NamedTuple):
+    id: str
+    name: str
+    latitude: float
+    longitude: float
+
+
+class GtfsFeed:
+    """Reads the files of a GTFS zip or of a folder with the extracted files"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def has(self, name: str) -> bool:
+        if zipfile.is_zipfile(self.path):
+            with zipfile.ZipFile(self.path) as feed:
+                return name in feed.namelist()
+        return os.path.exists(os.path.join(self.path, name))
+
+    def rows(self, name: str) -> Iterator[dict[str, str]]:
+        if zipfile.is_zipfile(self.path):
+            with zipfile.ZipFile(self.path) as feed, feed.open(name) as file:
+                yield from csv.DictReader(io.TextIOWrapper(file, encoding="utf-8-sig"))
+        else:
+            with open(os.path.join(self.path, name), encoding="utf-8-sig") as file:
+                yield from csv.DictReader(file)
+
+
+def read_stops(feed: GtfsFeed) -> list[Stop]:
+    """Stations of the feed, platforms are left out like the API does.
+
+    Only stops.txt is read, the stop times would take minutes and the search
+    waits for the index.
+    """
+    return [
+        Stop(
+            id=api_stop_id(row["stop_id"]),
+            name=row["stop_name"],
+            latitude=float(row["stop_lat"] or 0),
+            longitude=float(row["stop_lon"] or 0),
+        )
+        for row in feed.rows("stops.txt")
+        if not row.get("parent_station")
+    ]
+
+
+class StopIndex:
+    """Searches stops by name: prefix, word prefix, substring, then fuzzy"""
+
+    def __init__(self, stops: list[Stop]) -> None:
+        self.stops = stops
+        # sorted normalized names for prefix lookups with bisect
+        self.names = sorted((normalize(stop.name), i) for i, stop in enumerate(stops))
+        self.words = sorted(
+            (word, i) for name, i in self.names for word in set(name.split()[1:])
+        )
+        self.word_stops: dict[str, set[int]] = defaultdict(set)
+        for name, i in self.names:
+            for word in name.split():
+                self.word_stops[word].add(i)
+        self.vocabulary = list(self.word_stops)
+
+    @staticmethod
+    def prefixed(entries: list[tuple[str, int]], prefix: str) -> Iterator[int]:
+        for name, i in entries[bisect.bisect_left(entries, (prefix, -1)) :]:
+            if not name.startswith(prefix):
+                break
+            yield i
+
+    def search(self, query: str, limit: int) -> list[Stop]:
+        query = normalize(query)
+        if not query:
+            return []
+        found = dict.fromkeys(self.prefixed(self.names, query))
+        if len(found) < limit:
+            found.update(dict.fromkeys(self.prefixed(self.words, query)))
+        if len(found) < limit:
+            found.update(dict.fromkeys(i for name, i in self.names if query in name))
+        if len(found) < limit:
+            found.update(dict.fromkeys(sorted(self.fuzzy(query))))
+        # the exact name first, shorter names are usually the main stations
+        return sorted(
+            (self.stops[i] for i in found),
+            key=lambda stop: (normalize(stop.name) != query, len(stop.name), stop.name),
+        )[:limit]
+
+    def fuzzy(self, query: str) -> set[int]:
+        """Stops with a similarly spelled word for every word of the query"""
+        found: set[int] | None = None
+        for word in query.split():
+            close = difflib.get_close_matches(word, self.vocabulary, n=5, cutoff=0.75)
+            stops = set().union(*(self.word_stops[w] for w in close))
+            found = stops if found is None else found & stops
+        return found or set()
+
+
+def load_stop_index(feed_path: str, index_path: str) -> StopIndex | None:
+    """Load the stop index, rebuild it when the feed is newer than the index"""
+    if not os.path.exists(feed_path):
+        return None
+    if not os.path.exists(index_path) or os.path.getmtime(
+        index_path
+    ) < os.path.getmtime(feed_path):
+        _LOGGER.info(f"Building the stop index from {feed_path}")
+        stops = read_stops(GtfsFeed(feed_path))
+        # a search while the index is written must not read half of it
+        with open(index_path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump([list(stop) for stop in stops], file, ensure_ascii=False)
+        os.replace(index_path + ".tmp", index_path)
+    with open(index_path, encoding="utf-8") as file:
+        return StopIndex(
+            # indexes of older versions also hold the products of the stops
+            [Stop(*stop[:4]) for stop in json.load(file)]
+        )
+
+
+async def async_get_stop_index(hass: HomeAssistant) -> StopIndex | None:
+    """The stop index of the GTFS feed, None if there is no feed"""
+    data = hass.data.setdefault(DOMAIN, {})
+    if data.get(DATA_STOP_INDEX) is None:
+        data[DATA_STOP_INDEX] = await hass.async_add_executor_job(
+            load_stop_index,
+            hass.config.path(DOMAIN, GTFS_FEED),
+            hass.config.path(STORAGE_DIR, f"{DOMAIN}.stops.json"),
+        )
+    return data[DATA_STOP_INDEX]
+
+
+def parse_gtfs_time(value: str) -> int:
+    """Seconds since the start of the service day, can be more than 24 hours"""
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+
+def service_day_start(day: date) -> datetime:
+    """GTFS times count from noon minus 12 hours, midnight except on DST days"""
+    return datetime.combine(day, time(12), GTFS_TIMEZONE) - timedelta(hours=12)
+
+
+def write_column(file: BinaryIO, column: array) -> None:
+    """Columns are little-endian like the header, on any machine"""
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    column.tofile(file)
+
+
+class TimetableBuilder:
+    """Reads a feed into the integer columns of the timetable file"""
+
+    def __init__(self, feed: GtfsFeed) -> None:
+        self.feed = feed
+        self.strings: dict[str | None, int] = {None: 0}
+        self.routes: dict[str, tuple[int, int, int]] = {}
+        self.services: dict[str, int] = {}
+        self.trips: dict[str, tuple[int, int, int]] = {}
+        self.calendar: dict[int, list[str]] = {}
+        self.calendar_dates: dict[int, dict[str, int]] = defaultdict(dict)
+        # API stop id -> index of the stop in the order it was read
+        self.stop_ids: dict[int, int] = {}
+        # stop times bucketed per trip as (sequence << 32 | stop) and per stop
+        # as (departure << 32 | trip), 8 bytes per row instead of Python tuples
+        self.trip_rows: dict[int, array] = defaultdict(lambda: array("Q"))
+        self.stop_rows: dict[int, array] = defaultdict(lambda: array("Q"))
+
+    def string(self, value: str | None) -> int:
+        return self.strings.setdefault(value or None, len(self.strings))
+
+    def read_routes(self) -> None:
+        for row in self.feed.rows("routes.txt"):
+            self.routes[row["route_id"]] = (
+                self.string(row.get("route_short_name") or row.get("route_long_name")),
+                self.string(route_type_product(int(row["route_type"]))),
+                self.string(
+                    f"#{row['route_color']}" if row.get("route_color") else None
+                ),
+            )
+
+    def read_trips(self) -> None:
+        route_ids = {route_id: i for i, route_id in enumerate(self.routes)}
+        for row in self.feed.rows("trips.txt"):
+            self.trips[row["trip_id"]] = (
+                route_ids[row["route_id"]],
+                self.services.setdefault(row["service_id"], len(self.services)),
+                self.string(row.get("trip_headsign")),
+            )
+
+    def read_calendar(self) -> None:
+        if self.feed.has("calendar.txt"):
+            for row in self.feed.rows("calendar.txt"):
+                if row["service_id"] in self.services:
+                    self.calendar[self.services[row["service_id"]]] = [
+                        "".join(row[day] for day in WEEKDAYS),
+                        row["start_date"],
+                        row["end_date"],
+                    ]
+        if self.feed.has("calendar_dates.txt"):
+            for row in self.feed.rows("calendar_dates.txt"):
+                if row["service_id"] in self.services:
+                    service = self.services[row["service_id"]]
+                    self.calendar_dates[service][row["date"]] = int(
+                        row["exception_type"]
+                    )
+
+    def read_stop_times(self) -> None:
+        parents = {
+            row["stop_id"]: row.get("parent_station") or row["stop_id"]
+            for row in self.feed.rows("stops.txt")
+        }
+        trip_ids = {trip_id: i for i, trip_id in enumerate(self.trips)}
+        for row in self.feed.rows("stop_times.txt"):
+            if not row["departure_time"] or row["trip_id"] not in trip_ids:
+                continue
+            stop = self.stop_ids.setdefault(
+                int(api_stop_id(parents.get(row["stop_id"], row["stop_id"]))),
+                len(self.stop_ids),
+            )
+            trip = trip_ids[row["trip_id"]]
+            self.trip_rows[trip].append(int(row["stop_sequence"]) << 32 | stop)
+            self.stop_rows[stop].append(
+                parse_gtfs_time(row["departure_time"]) << 32 | trip
+            )
+
+    def trip_columns(self) -> tuple[array, array]:
+        """trip_start and trip_stops: the stops of every trip in sequence"""
+        trip_start = array("I", [0])
+        trip_stops = array("I")
+        for trip in range(len(self.trips)):
+            rows = sorted(self.trip_rows.pop(trip, ()))
+            trip_stops.extend(value & 0xFFFFFFFF for value in rows)
+            trip_start.append(len(trip_stops))
+        return trip_start, trip_stops
+
+    def stop_columns(
+        self, stops: list[int], trip_start: array, trip_stops: array
+    ) -> tuple[array, array, array]:
+        """stop_start, times and positions: the departures of the stops (in
+        this order, which trip_stops must use too) sorted by time, and their
+        position in the trip ordered columns"""
+        stop_start = array("I", [0])
+        times = array("I")
+        positions = array("I")
+        # a trip can pass a stop twice (Ringbahn), every visit is used once
+        used = bytearray(len(trip_stops))
+        for i, stop in enumerate(stops):
+            for value in sorted(self.stop_rows.pop(stop, ())):
+                trip = value & 0xFFFFFFFF
+                times.append(value >> 32)
+                position = next(
+                    p
+                    for p in range(trip_start[trip], trip_start[trip + 1])
+                    if trip_stops[p] == i and not used[p]
+                )
+                used[position] = 1
+                positions.append(position)
+            stop_start.append(len(times))
+        return stop_start, times, positions
+
+    def write(self, path: str) -> None:
+        trip_start, trip_stops = self.trip_columns()
+        # stops sorted by their API id, the trips refer to them in that order
+        sorted_stops = sorted(self.stop_ids.items())
+        order = array("I", bytes(4 * len(sorted_stops)))
+        for i, (_, stop) in enumerate(sorted_stops):
+            order[stop] = i
+        for i, stop in enumerate(trip_stops):
+            trip_stops[i] = order[stop]
+        stop_start, times, positions = self.stop_columns(
+            [stop for _, stop in sorted_stops], trip_start, trip_stops
+        )
+        metadata = json.dumps(
+            {
+                "strings": list(self.strings),
+                "calendar": self.calendar,
+                "calendar_dates": self.calendar_dates,
+            }
+        ).encode()
+        columns = [
+            array("Q", (stop_id for stop_id, _ in sorted_stops)),
+            stop_start,
+            times,
+            positions,
+            trip_start,
+            trip_stops,
+            *(array("I", (trip[i] for trip in self.trips.values())) for i in range(3)),
+            *(
+                array("I", (route[i] for route in self.routes.values()))
+                for i in range(3)
+            ),
+        ]
+        with open(path, "wb") as file:
+            file.write(
+                TIMETABLE_HEADER.pack(
+                    TIMETABLE_MAGIC,
+                    len(sorted_stops),
+                    len(times),
+                    len(self.trips),
+                    len(self.routes),
+                    len(metadata),
+                )
+            )
+            for column in columns:
+                write_column(file, column)
+            file.write(metadata)
+
+
+def build_timetable(feed: GtfsFeed, path: str) -> None:
+    """Write the timetable file: integer columns, stop times sorted by
+    (stop, departure) and a second copy of them sorted by (trip, sequence).
+
+    Layout (little-endian, all arrays of 32 bit integers unless noted):
+
+        header         TIMETABLE_HEADER
+        stop_ids       n_stops x u64, sorted API stop ids
+        stop_start     n_stops + 1 offsets into the stop ordered columns
+        times          n_stop_times seconds since the start of the service day
+        positions      n_stop_times position of the row in the trip ordered columns
+        trip_start     n_trips + 1 offsets into the trip ordered columns
+        trip_stops     n_stop_times index into stop_ids
+        trip_routes    n_trips index into the routes
+        trip_services  n_trips index into the services
+        trip_headsigns n_trips index into the strings
+        route_names    n_routes index into the strings
+        route_products n_routes index into the strings
+        route_colors   n_routes index into the strings
+        metadata       JSON: strings, calendar and calendar dates by service
+    """
+    builder = TimetableBuilder(feed)
+    builder.read_routes()
+    builder.read_trips()
+    builder.read_calendar()
+    builder.read_stop_times()
+    builder.write(path)
+
+
+class Timetable:
+    """Scheduled departures from the memory-mapped timetable file.
+
+    Nothing but the small metadata is read at startup, lookups are binary
+    searches in the mapped columns and only touch the pages they need.
+    """
+
+    def __init__(self, path: str) -> None:
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_stops, n_stop_times, n_trips, n_routes, metadata_size = (
+            TIMETABLE_HEADER.unpack_from(self.map)
+        )
+        if magic != TIMETABLE_MAGIC:
+            raise ValueError(f"{path} is not a timetable of this version")
+        view = memoryview(self.map)
+        offset = TIMETABLE_HEADER.size
+
+        def column(length: int, typecode: Literal["I", "Q"] = "I") -> memoryview:
+            nonlocal offset
+            size = length * (8 if typecode == "Q" else 4)
+            values = view[offset : offset + size].cast(typecode)
+            offset += size
+            if sys.byteorder == "big":
+                # the file is little-endian, swap a copy instead of mapping it
+                swapped = array(typecode, values)
+                swapped.byteswap()
+                return memoryview(swapped)
+            return values
+
+        self.stop_ids = column(n_stops, "Q")
+        self.stop_start = column(n_stops + 1)
+        self.times = column(n_stop_times)
+        self.positions = column(n_stop_times)
+        self.trip_start = column(n_trips + 1)
+        self.trip_stops = column(n_stop_times)
+        self.trip_routes = column(n_trips)
+        self.trip_services = column(n_trips)
+        self.trip_headsigns = column(n_trips)
+        self.route_names = column(n_routes)
+        self.route_products = column(n_routes)
+        self.route_colors = column(n_routes)
+        metadata = json.loads(bytes(view[offset : offset + metadata_size]))
+        self.strings: list[str | None] = metadata["strings"]
+        self.calendar: dict[str, list[str]] = metadata["calendar"]
+        self.calendar_dates: dict[str, dict[str, int]] = metadata["calendar_dates"]
+
+    def stop_index(self, stop_id: int | str) -> int | None:
+        """Position of a stop in the stop ordered columns, for old and new ids"""
+        stop = int(stop_id_of(stop_id))
+        i = bisect.bisect_left(self.stop_ids, stop)
+        if i < len(self.stop_ids) and self.stop_ids[i] == stop:
+            return i
+        return None
+
+    @lru_cache(maxsize=4)
+    def services(self, day: date) -> frozenset[int]:
+        """Services running on a day"""
+        key = day.strftime("%Y%m%d")
+        services = {
+            int(service)
+            for service, (weekdays, start, end) in self.calendar.items()
+            if start <= key <= end and weekdays[day.weekday()] == "1"
+        }
+        for service, dates in self.calendar_dates.items():
+            if dates.get(key) == 1:
+                services.add(int(service))
+            elif dates.get(key) == 2:
+                services.discard(int(service))
+        return frozenset(services)
+
+    def passes(self, position: int, trip: int, stop: int) -> bool:
+        """Whether the trip passes a stop after the given position"""
+        return (
+            stop in self.trip_stops[position + 1 : self.trip_start[trip + 1]].tolist()
+        )
+
+    def departures_on(  # pylint: disable=too-many-arguments,too-many-positional-arguments,too-many-locals
+        self,
+        day: date,
+        stop: int,
+        after: datetime,
+        until: datetime,
+        limit: int,
+        direction: int | None,
+        allows: Callable[[str, str | None, str | None], bool] | None,
+    ) -> Iterator[Departure]:
+        start = service_day_start(day)
+        services = self.services(day)
+        stop_id = self.stop_ids[stop]
+        first, last = self.stop_start[stop], self.stop_start[stop + 1]
+        i = bisect.bisect_left(
+            self.times, int((after - start).total_seconds()), first, last
+        )
+        until_seconds = int((until - start).total_seconds())
+        found = 0
+        while i < last and self.times[i] <= until_seconds and found < limit:
+            position = self.positions[i]
+            trip = bisect.bisect_right(self.trip_start, position) - 1
+            route = self.trip_routes[trip]
+            if (
+                self.trip_services[trip] in services
+                and (
+                    allows is None
+                    or allows(
+                        str(stop_id),
+                        self.strings[self.route_names[route]],
+                        self.strings[self.route_products[route]],
+                    )
+                )
+                and (direction is None or self.passes(position, trip, direction))
+            ):
+                found += 1
+                yield self.departure(
+                    start + timedelta(seconds=self.times[i]), stop_id, trip
+                )
+            i += 1
+
+    def departure(self, timestamp: datetime, stop_id: int, trip: int) -> Departure:
+        route = self.trip_routes[trip]
+        product = self.strings[self.route_products[route]]
+        line_visuals = (TRANSPORT_TYPE_VISUALS.get(product) if product else None) or {}
+        return Departure(
+            trip_id=f"gtfs:{trip}",
+            stop_id=str(stop_id),
+            # routes without a name or of an unknown type are rare in the feed
+            line_name=sys.intern(self.strings[self.route_names[route]] or ""),
+            line_type=sys.intern(product or ""),
+            timestamp=timestamp,
+            direction=intern(self.strings[self.trip_headsigns[trip]]),
+            icon=line_visuals.get("icon") or DEFAULT_ICON,
+            bg_color=intern(self.strings[self.route_colors[route]]),
+            fallback_color=line_visuals.get("color"),
+            planned_timestamp=timestamp,
+        )
+
+    def departures(  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self,
+        stop_id: int,
+        after: datetime,
+        until: datetime,
+        limit: int,
+        direction: str | None = None,
+        allows: Callable[[str, str | None, str | None], bool] | None = None,
+    ) -> list[Departure]:
+        """Scheduled departures of a stop, `allows(stop_id, line_name, product)`
+        filters them before the limit applies"""
+        stop = self.stop_index(stop_id)
+        if stop is None:
+            return []
+        direction_stop = self.stop_index(direction) if direction else None
+        if direction and direction_stop is None:
+            return []
+        after = after.astimezone(GTFS_TIMEZONE)
+        until = until.astimezone(GTFS_TIMEZONE)
+        departures: list[Departure] = []
+        # trips after midnight belong to the service day before, and a window
+        # past midnight also needs the trips of the next service day
+        day = after.date() - timedelta(days=1)
+        while day <= until.date():
+            departures += self.departures_on(
+                day, stop, after, until, limit, direction_stop, allows
+            )
+            day += timedelta(days=1)
+        return sorted(departures, key=lambda d: d.timestamp)[:limit]
+
+
+def load_timetable(feed_path: str, path: str) -> Timetable | None:
+    """Open the timetable file, build it first when it is older than the feed.
+
+    The build parses the whole feed and takes minutes, it can also be done
+    offline with scripts/build_timetable.py.
+    """
+    if os.path.exists(feed_path) and (
+        not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(feed_path)
+    ):
+        _LOGGER.info(f"Building the timetable from {feed_path}, this takes a while")
+        build_timetable(GtfsFeed(feed_path), path + ".tmp")
+        os.replace(path + ".tmp", path)
+    if not os.path.exists(path):
+        return None
+    return Timetable(path)
+
+
+@callback
+def async_get_timetable(hass: HomeAssistant) -> Timetable | None:
+    """The timetable of the GTFS feed, None if there is no feed or it is still
+    being built in the background. A failed load is tried again after
+    TIMETABLE_RETRY."""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_TIMETABLE not in data:
+        loading = hass.async_add_executor_job(
+            load_timetable,
+            hass.config.path(DOMAIN, GTFS_FEED),
+            hass.config.path(DOMAIN, GTFS_TIMETABLE),
+        )
+        data[DATA_TIMETABLE] = loading
+
+        @callback
+        def async_retry(_: datetime) -> None:
+            if data.get(DATA_TIMETABLE) is loading:
+                del data[DATA_TIMETABLE]
+
+        @callback
+        def async_loaded(_: asyncio.Future) -> None:
+            if loading.cancelled() or loading.exception() is None:
+                return
+            _LOGGER.error(
+                "Failed to load the timetable, trying again in %s: %s",
+                TIMETABLE_RETRY,
+                loading.exception(),
+            )
+            async_call_later(hass, TIMETABLE_RETRY, async_retry)
+
+        loading.add_done_callback(async_loaded)
+    loading = data[DATA_TIMETABLE]
+    if not loading.done() or loading.cancelled() or loading.exception() is not None:
+        return None
+    return loading.result()
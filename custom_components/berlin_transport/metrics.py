@@ -0,0 +1,170 @@
+"""Request metrics of a stop, per direction."""
+
+from __future__ import annotations
+import bisect
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any
+
+from homeassistant.util import dt as dt_util
+
+# upper bounds in seconds, the last bucket takes everything slower
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+@dataclass
+class Histogram:
+    counts: list[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    count: int = 0
+    total: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: Histogram) -> None:
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile"""
+        if not self.count:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return None
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "buckets": {
+                f"<={bound}" if i < len(LATENCY_BUCKETS) else "inf": count
+                for i, (bound, count) in enumerate(
+                    zip((*LATENCY_BUCKETS, None), self.counts)
+                )
+            },
+        }
+
+
+@dataclass
+class DirectionMetrics:
+    latency: Histogram = field(default_factory=Histogram)
+    # of the last response
+    bytes: int = 0
+    parse_time: float = 0.0
+    received: int = 0
+    kept: int = 0
+    bytes_total: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    last_error: str | None = None
+
+    def response(
+        self, latency: float, size: int, parse_time: float, received: int, kept: int
+    ) -> None:
+        self.cache_misses += 1
+        self.latency.observe(latency)
+        self.bytes = size
+        self.bytes_total += size
+        self.parse_time = parse_time
+        self.received = received
+        self.kept = kept
+
+    def failed(self, error: str) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+
+    def succeeded(self) -> None:
+        self.consecutive_failures = 0
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "latency": self.latency.as_dict(),
+            "bytes": self.bytes,
+            "bytes_total": self.bytes_total,
+            "parse_time": round(self.parse_time, 6),
+            "departures_received": self.received,
+            "departures_kept": self.kept,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_error": self.last_error,
+        }
+
+
+class StopMetrics:
+    """Metrics of the requests of a stop coordinator"""
+
+    def __init__(self) -> None:
+        self.directions: dict[str | None, DirectionMetrics] = {}
+        self.last_success: datetime | None = None
+
+    def direction(self, direction: str | None) -> DirectionMetrics:
+        if direction not in self.directions:
+            self.directions[direction] = DirectionMetrics()
+        return self.directions[direction]
+
+    def latency(self) -> Histogram:
+        latency = Histogram()
+        for metrics in self.directions.values():
+            latency.merge(metrics.latency)
+        return latency
+
+    @property
+    def bytes(self) -> int:
+        return sum(m.bytes for m in self.directions.values())
+
+    @property
+    def parse_time(self) -> float:
+        return sum(m.parse_time for m in self.directions.values())
+
+    @property
+    def received(self) -> int:
+        return sum(m.received for m in self.directions.values())
+
+    @property
+    def kept(self) -> int:
+        return sum(m.kept for m in self.directions.values())
+
+    @property
+    def cache_hit_rate(self) -> float | None:
+        hits = sum(m.cache_hits for m in self.directions.values())
+        total = hits + sum(m.cache_misses for m in self.directions.values())
+        return hits / total if total else None
+
+    @property
+    def consecutive_failures(self) -> int:
+        return max(
+            (m.consecutive_failures for m in self.directions.values()), default=0
+        )
+
+    def seconds_since_success(self) -> float | None:
+        if self.last_success is None:
+            return None
+        return (dt_util.utcnow() - self.last_success).total_seconds()
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "last_success": self.last_success,
+            "seconds_since_success": self.seconds_since_success(),
+            "cache_hit_rate": self.cache_hit_rate,
+            "directions": {
+                str(direction): metrics.as_dict()
+                for direction, metrics in self.directions.items()
+            },
+        }
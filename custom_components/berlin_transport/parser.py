@@ -0,0 +1,83 @@
+"""Incremental parser for departures responses."""
+
+from __future__ import annotations
+import codecs
+import json
+import re
+import time
+from typing import Callable
+
+from .departure import Departure
+
+DEPARTURES_START = re.compile(r'\s*(?:\[|\{.*?"departures"\s*:\s*\[)', re.DOTALL)
+SEPARATOR = re.compile(r"[\s,]*")
+
+
+class DeparturesParser:
+    """Turns a departures response into Departure objects while it arrives.
+
+    Only one element of the `departures` array is held as a dict at a
+    time, and elements rejected by `keep` never become Departure objects.
+    Everything after the array (e.g. `realtimeDataUpdatedAt`) is ignored.
+    """
+
+    def __init__(self, keep: Callable[[dict], bool] | None = None) -> None:
+        self.keep = keep
+        self.decoder = json.JSONDecoder()
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.started = False
+        self.finished = False
+        self.departures: list[Departure] = []
+        self.size = 0
+        self.skipped = 0
+        # seconds spent parsing, without waiting for the network
+        self.parse_time = 0.0
+
+    def feed(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.finished:
+            return
+        started = time.perf_counter()
+        self.buffer += self.text.decode(chunk)
+        self.parse()
+        self.parse_time += time.perf_counter() - started
+
+    def close(self) -> list[Departure]:
+        started = time.perf_counter()
+        self.buffer += self.text.decode(b"", final=True)
+        self.parse()
+        self.parse_time += time.perf_counter() - started
+        if not self.finished:
+            raise ValueError("Incomplete departures response")
+        return self.departures
+
+    def parse(self) -> None:
+        if not self.started:
+            match = DEPARTURES_START.match(self.buffer)
+            if match is None:
+                return
+            self.buffer = self.buffer[match.end() :]
+            self.started = True
+
+        position = 0
+        while True:
+            # SEPARATOR matches the empty string too, it never fails
+            separator = SEPARATOR.match(self.buffer, position)
+            if separator is not None:
+                position = separator.end()
+            if position == len(self.buffer):
+                break
+            if self.buffer[position] == "]":
+                self.finished = True
+                break
+            try:
+                source, position = self.decoder.raw_decode(self.buffer, position)
+            except json.JSONDecodeError:
+                # the element continues in the next chunk
+                break
+            if self.keep is None or self.keep(source):
+                self.departures.append(Departure.from_dict(source))
+            else:
+                self.skipped += 1
+        self.buffer = self.buffer[position:]
@@ -0,0 +1,308 @@
+"""Live vehicle positions from the radar endpoint, shared by all stops."""
+
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator
+
+from aiohttp import ClientError, ClientTimeout
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
+
+from .const import (
+    DOMAIN,
+    API_TIMEOUT,
+    DATA_COORDINATORS,
+    DATA_RADAR,
+    RADAR_INTERVAL,
+    RADAR_MARGIN,
+    RADAR_MAX_RESULTS,
+)
+from .endpoints import EndpointPool, async_get_endpoints
+from .fetcher import BackingOff, Fetcher, async_get_fetcher
+
+_LOGGER = logging.getLogger(__name__)
+
+# side of a grid cell in degrees, roughly 1 km in Berlin
+GRID_CELL = 0.01
+EARTH_RADIUS = 6371000
+
+
+def distance(a: tuple[float, float], b: tuple[float, float]) -> float:
+    """Meters between two (latitude, longitude) points"""
+    lat1, lon1, lat2, lon2 = map(math.radians, (*a, *b))
+    h = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(h))
+
+
+@callback
+def async_get_radar(hass: HomeAssistant) -> RadarCoordinator:
+    """Return the radar shared by all sensors, create it if needed"""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_RADAR not in data:
+        data[DATA_RADAR] = RadarCoordinator(hass)
+    return data[DATA_RADAR]
+
+
+@dataclass(frozen=True, slots=True)
+class Vehicle:
+    trip_id: str
+    location: tuple[float, float]
+    line_name: str | None = None
+    direction: str | None = None
+
+    @classmethod
+    def from_dict(cls, source: dict) -> Vehicle | None:
+        location = source.get("location") or {}
+        if (
+            not source.get("tripId")
+            or location.get("latitude") is None
+            or location.get("longitude") is None
+        ):
+            return None
+        return cls(
+            trip_id=source["tripId"],
+            location=(location["latitude"], location["longitude"]),
+            line_name=(source.get("line") or {}).get("name"),
+            direction=source.get("direction"),
+        )
+
+
+@dataclass(frozen=True)
+class Area:
+    """Bounding box the radar is asked for"""
+
+    north: float
+    west: float
+    south: float
+    east: float
+
+    @classmethod
+    def around(cls, location: tuple[float, float], margin: float) -> Area:
+        latitude, longitude = location
+        return cls(
+            latitude + margin, longitude - margin, latitude - margin, longitude + margin
+        )
+
+    def overlaps(self, other: Area) -> bool:
+        return (
+            self.south <= other.north
+            and other.south <= self.north
+            and self.west <= other.east
+            and other.west <= self.east
+        )
+
+    def union(self, other: Area) -> Area:
+        return Area(
+            max(self.north, other.north),
+            min(self.west, other.west),
+            min(self.south, other.south),
+            max(self.east, other.east),
+        )
+
+    def params(self) -> dict[str, str]:
+        return {
+            "north": f"{self.north:.5f}",
+            "west": f"{self.west:.5f}",
+            "south": f"{self.south:.5f}",
+            "east": f"{self.east:.5f}",
+        }
+
+
+def radar_areas(locations: Iterable[tuple[float, float]], margin: float) -> list[Area]:
+    """As few boxes as possible covering every stop with a margin: stops
+    close to each other share one box, distant ones (Berlin and Cottbus)
+    don't make a box over everything in between"""
+    areas: list[Area] = []
+    for location in sorted(set(locations)):
+        area = Area.around(location, margin)
+        # a grown box can overlap boxes it didn't before
+        while True:
+            overlapping = [a for a in areas if a.overlaps(area)]
+            if not overlapping:
+                break
+            for other in overlapping:
+                areas.remove(other)
+                area = area.union(other)
+        areas.append(area)
+    return areas
+
+
+class VehicleIndex:
+    """Vehicles by trip and in a grid of GRID_CELL degrees, so both
+    "where is the vehicle of this departure" and "what is near this stop"
+    are answered without scanning all vehicles"""
+
+    def __init__(self, vehicles: Iterable[Vehicle] = ()) -> None:
+        self.trips: dict[str, Vehicle] = {}
+        self.cells: dict[tuple[int, int], list[Vehicle]] = defaultdict(list)
+        for vehicle in vehicles:
+            self.add(vehicle)
+
+    def __len__(self) -> int:
+        return len(self.trips)
+
+    @staticmethod
+    def cell(location: tuple[float, float]) -> tuple[int, int]:
+        return (
+            math.floor(location[0] / GRID_CELL),
+            math.floor(location[1] / GRID_CELL),
+        )
+
+    def add(self, vehicle: Vehicle) -> None:
+        if vehicle.trip_id in self.trips:
+            # the same trip in two overlapping areas
+            return
+        self.trips[vehicle.trip_id] = vehicle
+        self.cells[self.cell(vehicle.location)].append(vehicle)
+
+    def get(self, trip_id: str) -> Vehicle | None:
+        return self.trips.get(trip_id)
+
+    def nearby(self, location: tuple[float, float], radius: float) -> Iterator[Vehicle]:
+        """Vehicles within `radius` meters of a location"""
+        # a degree of latitude is ~111 km, a degree of longitude less
+        cells_lat = math.ceil(radius / 111000 / GRID_CELL)
+        cells_lon = math.ceil(
+            radius
+            / (111000 * max(math.cos(math.radians(location[0])), 0.01))
+            / GRID_CELL
+        )
+        row, column = self.cell(location)
+        for i in range(row - cells_lat, row + cells_lat + 1):
+            for j in range(column - cells_lon, column + cells_lon + 1):
+                for vehicle in self.cells.get((i, j), ()):
+                    if distance(location, vehicle.location) <= radius:
+                        yield vehicle
+
+
+class RadarCoordinator(DataUpdateCoordinator[VehicleIndex]):
+    """Polls /radar for the areas around all stops with a position tracking
+    sensor, one request per area instead of one per trip.
+
+    Polls only while sensors listen. The stop coordinates are taken from the
+    departures of the stops, so the first poll waits for those.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        super().__init__(
+            hass,
+            _LOGGER,
+            name=f"{DOMAIN}_radar",
+            update_interval=RADAR_INTERVAL,
+        )
+        # sensor id -> stop id
+        self.sensor_stops: dict[str, int] = {}
+        self.fetcher: Fetcher = async_get_fetcher(hass)
+        self.endpoints: EndpointPool = async_get_endpoints(hass)
+
+    @callback
+    def async_subscribe(self, sensor_id: str, stop_id: int) -> None:
+        self.sensor_stops[sensor_id] = stop_id
+
+    @callback
+    def async_unsubscribe(self, sensor_id: str) -> None:
+        self.sensor_stops.pop(sensor_id, None)
+
+    def stop_locations(
+        self, stop_ids: Iterable[int] | None = None
+    ) -> set[tuple[float, float]]:
+        """Coordinates of the tracked stops (and their nearby stops), as
+        returned with their departures"""
+        coordinators = self.hass.data.get(DOMAIN, {}).get(DATA_COORDINATORS, {})
+        locations: set[tuple[float, float]] = set()
+        for stop_id in set(
+            self.sensor_stops.values() if stop_ids is None else stop_ids
+        ):
+            coordinator = coordinators.get(stop_id)
+            if coordinator is None or not coordinator.data:
+                continue
+            for departures in coordinator.data.values():
+                locations.update(
+                    d.stop_location for d in departures if d.stop_location is not None
+                )
+        return locations
+
+    async def _async_update_data(self) -> VehicleIndex:
+        areas = radar_areas(self.stop_locations(), RADAR_MARGIN)
+        if not areas:
+            return self.data or VehicleIndex()
+        results = await asyncio.gather(*(self.fetch_area(area) for area in areas))
+        if all(result is None for result in results):
+            raise UpdateFailed("Failed to fetch vehicle positions")
+        return VehicleIndex(
+            vehicle for result in results if result is not None for vehicle in result
+        )
+
+    async def fetch_area(self, area: Area) -> list[Vehicle] | None:
+        params = {
+            **area.params(),
+            "results": str(RADAR_MAX_RESULTS),
+            "frames": "1",
+            "polylines": "false",
+            "pretty": "false",
+        }
+        timeout = ClientTimeout(total=API_TIMEOUT)
+        for endpoint in self.endpoints.candidates():
+            started = time.monotonic()
+            try:
+                async with self.fetcher.get(
+                    endpoint.url + "/radar", params=params, timeout=timeout
+                ) as response:
+                    response.raise_for_status()
+                    body = await response.read()
+                movements = json.loads(body)
+                # newer hafas-rest-api versions wrap the list
+                if isinstance(movements, dict):
+                    movements = movements.get("movements", [])
+                vehicles = [Vehicle.from_dict(m) for m in movements]
+            except BackingOff as ex:
+                _LOGGER.debug("Radar skipped: %s", ex)
+                continue
+            except (ClientError, asyncio.TimeoutError) as ex:
+                _LOGGER.debug("Radar error: %s", ex)
+                endpoint.failed(f"radar: {str(ex) or type(ex).__name__}")
+                continue
+            except (ValueError, AttributeError) as ex:
+                _LOGGER.warning(f"Radar invalid JSON: {ex}")
+                endpoint.failed(f"radar: invalid JSON: {ex}")
+                continue
+            endpoint.succeeded(time.monotonic() - started)
+            _LOGGER.debug(
+                "OK: %d vehicles from %s (%d bytes)",
+                len(vehicles),
+                response.url,
+                len(body),
+            )
+            return [v for v in vehicles if v is not None]
+        return None
+
+    def vehicles_near(self, stop_id: int, radius: float) -> list[Vehicle]:
+        """Vehicles within `radius` meters of a stop"""
+        if not self.data:
+            return []
+        vehicles = {}
+        for location in self.stop_locations([stop_id]):
+            for vehicle in self.data.nearby(location, radius):
+                vehicles[vehicle.trip_id] = vehicle
+        return list(vehicles.values())
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "sensors": len(self.sensor_stops),
+            "areas": [
+                area.params()
+                for area in radar_areas(self.stop_locations(), RADAR_MARGIN)
+            ],
+            "vehicles": len(self.data) if self.data is not None else None,
+            "last_update_success": self.last_update_success,
+        }
@@ -4,34 +4,54 @@
 
 from __future__ import annotations
 import logging
-from datetime import datetime, timedelta
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, NamedTuple
 
-from requests.exceptions import HTTPError, InvalidJSONError, Timeout
-from requests_cache import CachedSession
 import voluptuous as vol
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 import homeassistant.helpers.config_validation as cv
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
+from homeassistant.helpers.event import async_call_later, async_track_time_interval
+from homeassistant.helpers.restore_state import ExtraStoredData, RestoreEntity
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.components.sensor import SensorEntity
+from homeassistant.components.sensor import (
+    SensorDeviceClass,
+    SensorEntity,
+    SensorStateClass,
+)
 from homeassistant.components.sensor import PLATFORM_SCHEMA
+from homeassistant.const import PERCENTAGE, UnitOfInformation, UnitOfTime
+from homeassistant.helpers.entity import EntityCategory
+from homeassistant.helpers.update_coordinator import CoordinatorEntity
 
 from .const import (  # pylint: disable=unused-import
     DOMAIN,  # noqa
     SCAN_INTERVAL,  # noqa
-    API_ENDPOINT,
+    API_DEFAULT_DURATION,
     API_MAX_RESULTS,
     FALLBACK_TIME,
+    STARTUP_STAGGER,
+    TICK_INTERVAL,
     CONF_DEPARTURES,
     CONF_DEPARTURES_DIRECTION,
     CONF_DEPARTURES_EXCLUDED_STOPS,
     CONF_DEPARTURES_EXCLUDED_LINES,
+    CONF_DEPARTURES_INCLUDED_LINES,
     CONF_DEPARTURES_DURATION,
+    CONF_DEPARTURES_PARTIAL_RESULTS,
     CONF_DEPARTURES_STOP_ID,
     CONF_DEPARTURES_WALKING_TIME,
+    CONF_MIN_SCAN_INTERVAL,
+    CONF_MAX_SCAN_INTERVAL,
+    SCAN_INTERVAL_FLOOR,
     CONF_SHOW_API_LINE_COLORS,
+    CONF_RECORD_DEPARTURES,
+    CONF_SCHEDULE_FALLBACK,
+    CONF_VEHICLE_POSITIONS,
+    CONF_DESTINATION,
     CONF_TYPE_BUS,
     CONF_TYPE_EXPRESS,
     CONF_TYPE_FERRY,
@@ -41,8 +61,15 @@ from .const import (  # pylint: disable=unused-import
     CONF_TYPE_TRAM,
     CONF_DEPARTURES_NAME,
     DEFAULT_ICON,
+    TRIP_LOOKUPS,
 )
-from .departure import Departure
+from .coordinator import StopCoordinator, async_get_coordinator, split_directions
+from .departure import Departure, stop_id_of
+from .filters import FilterSpec, validate_lines
+from .gtfs import async_get_timetable
+from .metrics import StopMetrics
+from .radar import RadarCoordinator, async_get_radar, distance
+from .trips import async_get_trips
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -63,11 +90,27 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
                 vol.Required(CONF_DEPARTURES_NAME): cv.string,
                 vol.Required(CONF_DEPARTURES_STOP_ID): cv.positive_int,
                 vol.Optional(CONF_DEPARTURES_DIRECTION): cv.string,
+                vol.Optional(CONF_DEPARTURES_PARTIAL_RESULTS, default=False): cv.boolean,
                 vol.Optional(CONF_DEPARTURES_EXCLUDED_STOPS): cv.string,
-                vol.Optional(CONF_DEPARTURES_EXCLUDED_LINES): cv.string,
+                vol.Optional(CONF_DEPARTURES_EXCLUDED_LINES): vol.All(
+                    cv.string, validate_lines
+                ),
+                vol.Optional(CONF_DEPARTURES_INCLUDED_LINES): vol.All(
+                    cv.string, validate_lines
+                ),
                 vol.Optional(CONF_DEPARTURES_DURATION): cv.positive_int,
                 vol.Optional(CONF_DEPARTURES_WALKING_TIME, default=1): cv.positive_int,
                 vol.Optional(CONF_SHOW_API_LINE_COLORS, default=False): cv.boolean,
+                vol.Optional(CONF_RECORD_DEPARTURES, default=True): cv.boolean,
+                vol.Optional(CONF_SCHEDULE_FALLBACK, default=False): cv.boolean,
+                vol.Optional(CONF_VEHICLE_POSITIONS, default=False): cv.boolean,
+                vol.Optional(CONF_DESTINATION): cv.positive_int,
+                vol.Optional(CONF_MIN_SCAN_INTERVAL): vol.All(
+                    cv.positive_int, vol.Range(min=SCAN_INTERVAL_FLOOR)
+                ),
+                vol.Optional(CONF_MAX_SCAN_INTERVAL): vol.All(
+                    cv.positive_int, vol.Range(min=SCAN_INTERVAL_FLOOR)
+                ),
                 **TRANSPORT_TYPES_SCHEMA,
             }
         ]
@@ -84,7 +127,11 @@ async def async_setup_platform(
     """Set up the sensor platform."""
     if CONF_DEPARTURES in config:
         for departure in config[CONF_DEPARTURES]:
-            async_add_entities([TransportSensor(hass, departure)])
+            sensor = create_sensor(hass, departure)
+            entities: list[SensorEntity] = [sensor]
+            if departure.get(CONF_DESTINATION):
+                entities.append(LeaveSensor(sensor, departure[CONF_DESTINATION]))
+            async_add_entities(entities)
 
 
 async def async_setup_entry(
@@ -92,30 +139,86 @@ async def async_setup_entry(
     config_entry: ConfigEntry,
     async_add_entities: AddEntitiesCallback,
 ) -> None:
-    async_add_entities([TransportSensor(hass, config_entry.data, config_entry.entry_id)])
+    sensor = create_sensor(hass, config_entry.data, config_entry.entry_id)
+    entities: list[SensorEntity] = [sensor]
+    if config_entry.data.get(CONF_DESTINATION):
+        entities.append(LeaveSensor(sensor, config_entry.data[CONF_DESTINATION]))
+    async_add_entities(
+        entities
+        + [MetricSensor(sensor, metric, config_entry.entry_id) for metric in METRICS]
+    )
+
+
+def create_sensor(
+    hass: HomeAssistant, config: dict, entry_id: str | None = None
+) -> TransportSensor:
+    # the recorder reads the excluded attributes from the class
+    if config.get(CONF_RECORD_DEPARTURES, True):
+        return TransportSensor(hass, config, entry_id)
+    return UnrecordedTransportSensor(hass, config, entry_id)
+
+
+class DepartureSnapshot(ExtraStoredData):
+    """Board of a sensor, kept by HA over restarts"""
+
+    def __init__(
+        self,
+        departures: list[Departure],
+        last_update_success: datetime | None,
+        realtime: bool,
+    ) -> None:
+        self.departures = departures
+        self.last_update_success = last_update_success
+        self.realtime = realtime
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "departures": [departure.as_stored() for departure in self.departures],
+            "last_update_success": (
+                self.last_update_success.isoformat() if self.last_update_success else None
+            ),
+            "realtime": self.realtime,
+        }
+
+    @classmethod
+    def from_dict(cls, stored: dict[str, Any]) -> DepartureSnapshot | None:
+        try:
+            last_update_success = stored.get("last_update_success")
+            return cls(
+                [Departure.from_stored(d) for d in stored.get("departures") or []],
+                datetime.fromisoformat(last_update_success) if last_update_success else None,
+                stored.get("realtime", True),
+            )
+        except (KeyError, TypeError, ValueError) as ex:
+            _LOGGER.debug(f"Ignoring invalid departure snapshot: {ex}")
+            return None
 
 
-class TransportSensor(SensorEntity):
+class TransportSensor(CoordinatorEntity[StopCoordinator], SensorEntity, RestoreEntity):
     departures: list[Departure] = []
 
     def __init__(self, hass: HomeAssistant, config: dict, entry_id: str | None = None) -> None:
+        super().__init__(async_get_coordinator(hass, config[CONF_DEPARTURES_STOP_ID]))
         self.hass: HomeAssistant = hass
         self.config: dict = config
         self._entry_id = entry_id
         self.stop_id: int = config[CONF_DEPARTURES_STOP_ID]
-        self.excluded_stops: str | None = config.get(CONF_DEPARTURES_EXCLUDED_STOPS)
-        self.excluded_lines: str | None = config.get(CONF_DEPARTURES_EXCLUDED_LINES)
+        self.filters: FilterSpec = FilterSpec.from_config(config)
         self.sensor_name: str | None = config.get(CONF_DEPARTURES_NAME)
         self.direction: str | None = config.get(CONF_DEPARTURES_DIRECTION)
+        self.partial_results: bool = config.get(CONF_DEPARTURES_PARTIAL_RESULTS) or False
         self.duration: int | None = config.get(CONF_DEPARTURES_DURATION)
         self.walking_time: int = config.get(CONF_DEPARTURES_WALKING_TIME) or 1
         # we add +1 minute anyway to delete the "just gone" transport
         self.show_api_line_colors: bool = config.get(CONF_SHOW_API_LINE_COLORS) or False
-        self.session: CachedSession = CachedSession(
-            backend="memory", cache_control=True, expire_after=timedelta(days=1)
-        )
+        self.schedule_fallback: bool = config.get(CONF_SCHEDULE_FALLBACK) or False
+        self.radar: RadarCoordinator | None = None
+        if config.get(CONF_VEHICLE_POSITIONS):
+            self.radar = async_get_radar(hass)
         self.last_update_success: datetime | None = None
+        self.realtime: bool = True
         self._attr_available: bool = True
+        self._board_fingerprint: tuple | None = None
 
     @property
     def name(self) -> str:
@@ -132,6 +235,10 @@ class TransportSensor(SensorEntity):
     def unique_id(self) -> str:
         return self._entry_id or f"stop_{self.stop_id}_{self.sensor_name}_departures"
 
+    @property
+    def available(self) -> bool:
+        return self._attr_available
+
     @property
     def state(self) -> str:
         next_departure = self.next_departure()
@@ -143,20 +250,180 @@ class TransportSensor(SensorEntity):
     def extra_state_attributes(self):
         return {
             "departures": [
-                departure.to_dict(self.show_api_line_colors, self.walking_time)
-                for departure in self.departures or []
-            ]
+                self.departure_attributes(departure) for departure in self.departures or []
+            ],
+            "update_interval": int(self.coordinator.interval.total_seconds()),
+            "realtime": self.realtime,
         }
 
-    def update(self):
-        departures = self.fetch_departures()
-        now_utc = datetime.utcnow()
-        if departures is None:
-            if (
-                self.departures and
-                self.last_update_success and
-                (now_utc - self.last_update_success) <= FALLBACK_TIME
+    def departure_attributes(self, departure: Departure) -> dict[str, Any]:
+        attributes = departure.to_dict(self.show_api_line_colors, self.walking_time)
+        if self.radar is None:
+            return attributes
+        location = self.vehicle_location(departure)
+        if location is None:
+            return attributes
+        # positions change on every radar poll, the cached dict stays as it is
+        return {
+            **attributes,
+            "vehicle_location": list(location),
+            "distance": (
+                round(distance(location, departure.stop_location))
+                if departure.stop_location
+                else None
+            ),
+        }
+
+    def vehicle_location(self, departure: Departure) -> tuple[float, float] | None:
+        """Position of the vehicle from the radar, or from the departures
+        response if the radar doesn't know the trip"""
+        if self.radar is not None and self.radar.data is not None:
+            vehicle = self.radar.data.get(departure.trip_id)
+            if vehicle is not None:
+                return vehicle.location
+        if departure.location and any(departure.location):
+            return departure.location
+        return None
+
+    async def async_added_to_hass(self) -> None:
+        self.coordinator.async_subscribe(self.unique_id, self.config, self.filters)
+        await super().async_added_to_hass()
+        if self.radar is not None:
+            self.radar.async_subscribe(self.unique_id, self.stop_id)
+            self.async_on_remove(self.radar.async_add_listener(self.async_write_board))
+        self.async_on_remove(
+            async_track_time_interval(self.hass, self._async_tick, TICK_INTERVAL)
+        )
+        if self.schedule_fallback:
+            # building the timetable takes a while, start it before it's needed
+            async_get_timetable(self.hass)
+        await self.async_restore_board()
+        if self.coordinator.has_directions(self.direction):
+            self._handle_coordinator_update()
+        elif self.departures:
+            # the restored board bridges the gap, so spread the first polls
+            # of all sensors instead of sending them at once after a restart
+            self.async_on_remove(
+                async_call_later(
+                    self.hass,
+                    random.uniform(0, STARTUP_STAGGER.total_seconds()),
+                    self._async_first_refresh,
+                )
+            )
+        else:
+            # the request is debounced, so sensors of the same stop share it
+            await self.coordinator.async_request_refresh()
+
+    async def async_restore_board(self) -> None:
+        """Show the board from before the restart, without the departures
+        that left in the meantime"""
+        extra_data = await self.async_get_last_extra_data()
+        if extra_data is None:
+            return
+        snapshot = DepartureSnapshot.from_dict(extra_data.as_dict())
+        if (
+            snapshot is None or
+            snapshot.last_update_success is None or
+            datetime.utcnow() - snapshot.last_update_success > FALLBACK_TIME
+        ):
+            # too old to be better than nothing
+            return
+        earliest = datetime.now(timezone.utc) + timedelta(minutes=self.walking_time)
+        self.departures = [d for d in snapshot.departures if d.timestamp >= earliest]
+        self.last_update_success = snapshot.last_update_success
+        self.realtime = snapshot.realtime
+        if self.departures:
+            self.async_write_board()
+
+    @callback
+    def _async_first_refresh(self, _now: datetime) -> None:
+        if not self.coordinator.has_directions(self.direction):
+            # no other sensor of the stop polled in the meantime
+            self.hass.async_create_task(self.coordinator.async_request_refresh())
+
+    @property
+    def extra_restore_state_data(self) -> DepartureSnapshot:
+        return DepartureSnapshot(self.departures, self.last_update_success, self.realtime)
+
+    async def async_will_remove_from_hass(self) -> None:
+        await super().async_will_remove_from_hass()
+        self.coordinator.async_unsubscribe(self.unique_id)
+        if self.radar is not None:
+            self.radar.async_unsubscribe(self.unique_id)
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        if self.coordinator.last_update_success and not self.coordinator.has_directions(
+            self.direction
+        ):
+            # subscribed after the last refresh, the next one will include us
+            return
+        departures = None
+        if self.coordinator.scheduled:
+            if self.coordinator.last_update_success and self.schedule_fallback:
+                departures = self.filter_departures(self.coordinator.data)
+        elif self.coordinator.last_update_success:
+            failed = self.coordinator.failed_directions.intersection(
+                split_directions(self.direction)
+            )
+            if not failed or (
+                self.partial_results and len(failed) < len(split_directions(self.direction))
             ):
+                departures = self.filter_departures(self.coordinator.data)
+        self.update_departures(departures, realtime=not self.coordinator.scheduled)
+        if self.radar is not None and not self.radar.data and self.departures:
+            # the radar needs the stop coordinates of the first departures
+            self.hass.async_create_task(self.radar.async_request_refresh())
+        self.async_write_board()
+
+    @callback
+    def _async_tick(self, now: datetime) -> None:
+        """Drop departures that can't be reached anymore without calling the API,
+        so state and icon follow the clock between polls"""
+        earliest = now + timedelta(minutes=self.walking_time)
+        departures = [d for d in self.departures if d.timestamp >= earliest]
+        if len(departures) == len(self.departures):
+            return
+        self.departures = departures
+        if not departures:
+            # the board ran empty, don't wait for the next scheduled poll
+            self.hass.async_create_task(self.coordinator.async_request_refresh())
+        self.async_write_board()
+
+    @callback
+    def async_write_board(self) -> None:
+        """Write the state only if something visible on the board changed,
+        identical polls would just bloat the recorder and the event bus"""
+        fingerprint = (
+            self._attr_available,
+            self.realtime,
+            self.coordinator.interval,
+            tuple(
+                (d.line_name, d.time, d.delay, d.cancelled, d.direction)
+                for d in self.departures
+            ),
+            tuple(self.vehicle_location(d) for d in self.departures)
+            if self.radar is not None
+            else None,
+        )
+        if fingerprint == self._board_fingerprint:
+            return
+        self._board_fingerprint = fingerprint
+        self.async_write_ha_state()
+
+    def update_departures(
+        self, departures: list[Departure] | None, realtime: bool = True
+    ) -> None:
+        now_utc = datetime.utcnow()
+        recent = (
+            self.realtime and
+            self.departures and
+            self.last_update_success and
+            (now_utc - self.last_update_success) <= FALLBACK_TIME
+        )
+        # a recent realtime board is better than the timetable
+        if departures is None or (not realtime and recent):
+            if recent:
                 self.departures = [
                     d for d in self.departures
                     if d.timestamp >= datetime.now(d.timestamp.tzinfo)
@@ -169,85 +436,266 @@ class TransportSensor(SensorEntity):
         else:
             self._attr_available = True
             self.departures = departures
-            self.last_update_success = now_utc
-
-    def fetch_directional_departure(self, direction: str | None) -> list[Departure] | None:
-        try:
-            response = self.session.get(
-                url=f"{API_ENDPOINT}/stops/{self.stop_id}/departures",
-                params={
-                    "when": (datetime.utcnow() + timedelta(minutes=self.walking_time)).isoformat(),
-                    "direction": direction,
-                    "duration": self.duration,
-                    "results": API_MAX_RESULTS,
-                    "suburban": self.config.get(CONF_TYPE_SUBURBAN) or False,
-                    "subway": self.config.get(CONF_TYPE_SUBWAY) or False,
-                    "tram": self.config.get(CONF_TYPE_TRAM) or False,
-                    "bus": self.config.get(CONF_TYPE_BUS) or False,
-                    "ferry": self.config.get(CONF_TYPE_FERRY) or False,
-                    "express": self.config.get(CONF_TYPE_EXPRESS) or False,
-                    "regional": self.config.get(CONF_TYPE_REGIONAL) or False,
-                },
-                timeout=30,
-            )
-            response.raise_for_status()
-        except (HTTPError, ConnectionError) as ex:
-            _LOGGER.warning(f"API error: {ex}")
-            return None
-        except Timeout as ex:
-            _LOGGER.warning(f"API timeout: {ex}")
-            return None
-
-        _LOGGER.debug(f"OK: departures for {self.stop_id}: {response.text}")
-
-        # parse JSON response
-        try:
-            departures = response.json()
-        except InvalidJSONError as ex:
-            _LOGGER.error(f"API invalid JSON: {ex}")
-            return None
-
-        if self.excluded_stops is None:
-            excluded_stops = []
-        else:
-            excluded_stops = self.excluded_stops.split(",")
-
-        if self.excluded_lines is None:
-            excluded_lines = []
-        else:
-            excluded_lines = self.excluded_lines.split(",")
-
-        # convert api data into objects
-        return [
-            Departure.from_dict(departure)
-            for departure in departures.get("departures")
-            if departure["stop"]["id"] not in excluded_stops
-            and departure["line"]["name"] not in excluded_lines
-        ]
-
-    def fetch_departures(self) -> list[Departure] | None:
+            self.realtime = realtime
+            if realtime:
+                self.last_update_success = now_utc
+
+    def filter_departures(
+        self, data: dict[str | None, list[Departure]]
+    ) -> list[Departure]:
+        """Narrow down the departures shared by the stop coordinator to this sensor"""
         departures = []
-
-        if self.direction is None:
-            res = self.fetch_directional_departure(self.direction)
-            if res is None:
-                return None
-            departures += res
-        else:
-            for direction in self.direction.split(","):
-                res = self.fetch_directional_departure(direction)
-                if res is None:
-                    return None
-                departures += res
+        for direction in split_directions(self.direction):
+            departures += data.get(direction, [])
+
+        # the shared query spans the windows of all sensors on this stop
+        earliest = datetime.now(timezone.utc) + timedelta(minutes=self.walking_time)
+        latest = earliest + timedelta(minutes=self.duration or API_DEFAULT_DURATION)
+        departures = [
+            departure
+            for departure in departures
+            if self.filters.matches(departure)
+            and earliest <= departure.timestamp <= latest
+        ]
 
         # Get rid of duplicates
         # Duplicates should only exist for the Ringbahn and filtering for both
         # directions
         deduplicated_departures = set(departures)
 
-        return sorted(deduplicated_departures, key=lambda d: d.timestamp)
+        # the shared query asks for more results when several sensors use
+        # the stop, every board still shows as many as it would on its own
+        return sorted(deduplicated_departures, key=lambda d: d.timestamp)[
+            :API_MAX_RESULTS
+        ]
 
     def next_departure(self):
         if self.departures and isinstance(self.departures, list):
             return self.departures[0]
         return None
+
+
+class LeaveSensor(CoordinatorEntity[StopCoordinator], SensorEntity):
+    """When to leave for the next departure that reaches a destination stop.
+
+    The board of the stop sensor decides which trips are looked up, and each
+    trip only once (see TripCache). The delay comes with the departures, so
+    the times follow it without asking for the trip again.
+    """
+
+    _attr_device_class = SensorDeviceClass.TIMESTAMP
+    _attr_icon = "mdi:walk"
+
+    def __init__(self, sensor: TransportSensor, destination: int) -> None:
+        super().__init__(sensor.coordinator)
+        self.sensor = sensor
+        self.destination = stop_id_of(destination)
+        self.trips = async_get_trips(sensor.hass)
+        # departures reaching the destination, with their arrival there
+        self.connections: list[tuple[Departure, datetime]] = []
+        self._attr_name = f"{sensor.name} leave by"
+        self._attr_unique_id = f"{sensor.unique_id}_leave"
+        self._state: datetime | None = None
+
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        self.async_on_remove(
+            async_track_time_interval(self.hass, self._async_tick, TICK_INTERVAL)
+        )
+        self._handle_coordinator_update()
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        # runs after the stop sensor took the new departures
+        self.hass.async_create_task(self.async_update_connections())
+
+    async def async_update_connections(self) -> None:
+        # trip ids of the GTFS timetable are unknown to the API
+        departures = self.sensor.departures if self.sensor.realtime else []
+        unknown = [d.trip_id for d in departures if self.trips.get(d.trip_id) is None]
+        # the next departures matter most, later ones follow with later polls
+        await self.trips.async_resolve(unknown[:TRIP_LOOKUPS])
+        connections = []
+        for departure in departures:
+            trip = self.trips.get(departure.trip_id)
+            if trip is None or departure.cancelled:
+                continue
+            travel_time = trip.travel_time(departure, self.destination)
+            if travel_time is not None:
+                connections.append((departure, departure.timestamp + travel_time))
+        self.connections = connections
+        self._state = self.native_value
+        self.async_write_ha_state()
+
+    @callback
+    def _async_tick(self, _now: datetime) -> None:
+        if self.native_value != self._state:
+            self._state = self.native_value
+            self.async_write_ha_state()
+
+    def leave_at(self, departure: Departure) -> datetime:
+        return departure.timestamp - timedelta(minutes=self.sensor.walking_time)
+
+    @property
+    def native_value(self) -> datetime | None:
+        now = datetime.now(timezone.utc)
+        for departure, _ in self.connections:
+            if self.leave_at(departure) >= now:
+                return self.leave_at(departure)
+        return None
+
+    @property
+    def extra_state_attributes(self) -> dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        return {
+            "destination": self.destination,
+            "connections": [
+                {
+                    "line_name": departure.line_name,
+                    "direction": departure.direction,
+                    "leave_at": self.leave_at(departure),
+                    "departure": departure.timestamp,
+                    "arrival": arrival,
+                    "delay": departure.delay,
+                }
+                for departure, arrival in self.connections
+                if self.leave_at(departure) >= now
+            ],
+        }
+
+
+class UnrecordedTransportSensor(TransportSensor):
+    """Keeps the departures attribute out of the recorder history"""
+
+    _unrecorded_attributes = frozenset({"departures"})
+
+
+class Metric(NamedTuple):
+    key: str
+    name: str
+    value: Callable[[StopMetrics], Any]
+    unit: str | None = None
+    device_class: SensorDeviceClass | None = None
+    state_class: SensorStateClass | None = SensorStateClass.MEASUREMENT
+    attributes: Callable[[StopMetrics], dict] | None = None
+    enabled: bool = False
+
+
+def latency_attributes(metrics: StopMetrics) -> dict:
+    latency = metrics.latency()
+    return {
+        "p50": quantile_ms(latency.quantile(0.5)),
+        "p90": quantile_ms(latency.quantile(0.9)),
+        "p99": quantile_ms(latency.quantile(0.99)),
+        "histogram": latency.as_dict()["buckets"],
+        "directions": {
+            str(direction): quantile_ms(m.latency.quantile(0.5))
+            for direction, m in metrics.directions.items()
+        },
+    }
+
+
+def mean_latency_ms(metrics: StopMetrics) -> int | None:
+    """Mean latency of all directions in milliseconds, None before any request"""
+    mean = metrics.latency().mean
+    return None if mean is None else round(mean * 1000)
+
+
+def quantile_ms(value: float | None) -> float | None:
+    """Upper bound of a quantile in milliseconds, None if it is unbounded"""
+    if value is None or value == float("inf"):
+        return None
+    return value * 1000
+
+
+METRICS = (
+    Metric(
+        "latency",
+        "Latency",
+        mean_latency_ms,
+        UnitOfTime.MILLISECONDS,
+        SensorDeviceClass.DURATION,
+        attributes=latency_attributes,
+    ),
+    Metric(
+        "response_size",
+        "Response size",
+        lambda m: m.bytes,
+        UnitOfInformation.BYTES,
+        SensorDeviceClass.DATA_SIZE,
+        attributes=lambda m: {
+            "total": sum(d.bytes_total for d in m.directions.values())
+        },
+    ),
+    Metric(
+        "parse_time",
+        "Parse time",
+        lambda m: round(m.parse_time * 1000, 2),
+        UnitOfTime.MILLISECONDS,
+        SensorDeviceClass.DURATION,
+    ),
+    Metric(
+        "departures_received",
+        "Departures received",
+        lambda m: m.received,
+        attributes=lambda m: {"kept": m.kept},
+    ),
+    Metric(
+        "cache_hit_rate",
+        "Cache hit rate",
+        lambda m: None if m.cache_hit_rate is None else round(m.cache_hit_rate * 100),
+        PERCENTAGE,
+    ),
+    Metric(
+        "consecutive_failures",
+        "Consecutive failures",
+        lambda m: m.consecutive_failures,
+        attributes=lambda m: {
+            "last_errors": {
+                str(direction): d.last_error
+                for direction, d in m.directions.items()
+                if d.consecutive_failures
+            }
+        },
+        enabled=True,
+    ),
+    Metric(
+        "last_success",
+        "Last successful update",
+        lambda m: m.last_success,
+        device_class=SensorDeviceClass.TIMESTAMP,
+        state_class=None,
+        enabled=True,
+    ),
+)
+
+
+class MetricSensor(CoordinatorEntity[StopCoordinator], SensorEntity):
+    """Diagnostic entity with a request metric of the stop of a sensor"""
+
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+
+    def __init__(self, sensor: TransportSensor, metric: Metric, entry_id: str) -> None:
+        super().__init__(sensor.coordinator)
+        self.metric = metric
+        self._attr_name = f"{sensor.name} {metric.name}"
+        self._attr_unique_id = f"{entry_id}_{metric.key}"
+        self._attr_native_unit_of_measurement = metric.unit
+        self._attr_device_class = metric.device_class
+        self._attr_state_class = metric.state_class
+        self._attr_entity_registry_enabled_default = metric.enabled
+
+    @property
+    def available(self) -> bool:
+        # failures are what these entities are about
+        return True
+
+    @property
+    def native_value(self) -> Any:
+        return self.metric.value(self.coordinator.metrics)
+
+    @property
+    def extra_state_attributes(self) -> dict | None:
+        if self.metric.attributes is None:
+            return None
+        return self.metric.attributes(self.coordinator.metrics)
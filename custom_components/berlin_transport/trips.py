@@ -0,0 +1,172 @@
+"""Trip details for leave-by times, fetched once per trip."""
+
+from __future__ import annotations
+import asyncio
+import json
+import logging
+import time
+from urllib.parse import quote
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Iterable
+
+from aiohttp import ClientError, ClientResponseError, ClientTimeout
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN, API_TIMEOUT, DATA_TRIPS, TRIP_GRACE
+from .departure import Departure, parse_time, stop_id_of
+from .endpoints import EndpointPool, async_get_endpoints
+from .fetcher import BackingOff, Fetcher, async_get_fetcher
+
+_LOGGER = logging.getLogger(__name__)
+
+TRIP_PARAMS = {
+    "stopovers": "true",
+    "remarks": "false",
+    "polyline": "false",
+    "pretty": "false",
+}
+
+
+@callback
+def async_get_trips(hass: HomeAssistant) -> TripCache:
+    """Return the trip cache shared by all sensors, create it if needed"""
+    data = hass.data.setdefault(DOMAIN, {})
+    if DATA_TRIPS not in data:
+        data[DATA_TRIPS] = TripCache(hass)
+    return data[DATA_TRIPS]
+
+
+@dataclass(frozen=True, slots=True)
+class Trip:
+    """Planned times of a trip at its stops, which don't change while it runs"""
+
+    trip_id: str
+    # planned arrival (departure at the first stop) by stop and station id,
+    # see stop_id_of()
+    arrivals: dict[str, datetime]
+    # planned arrival at the last stop
+    ends: datetime
+
+    @classmethod
+    def from_dict(cls, trip_id: str, source: dict) -> Trip:
+        # newer hafas-rest-api versions wrap the trip
+        source = source.get("trip", source)
+        arrivals: dict[str, datetime] = {}
+        for stopover in source.get("stopovers") or []:
+            when = stopover.get("plannedArrival") or stopover.get("plannedDeparture")
+            if not when:
+                continue
+            stop = stopover.get("stop") or {}
+            for stop_id in (stop.get("id"), (stop.get("station") or {}).get("id")):
+                if stop_id:
+                    # a loop line passes its first stop twice, keep the first
+                    arrivals.setdefault(stop_id_of(stop_id), parse_time(when))
+        ends = (
+            parse_time(source["plannedArrival"])
+            if source.get("plannedArrival")
+            else None
+        )
+        return cls(
+            trip_id, arrivals, ends or max(arrivals.values(), default=dt_util.utcnow())
+        )
+
+    def travel_time(self, departure: Departure, destination: str) -> timedelta | None:
+        """Planned time from the departure's stop to the destination, None if
+        the trip doesn't go there after the departure"""
+        arrival = self.arrivals.get(destination)
+        planned = departure.planned_timestamp or departure.timestamp
+        if arrival is None or arrival <= planned:
+            return None
+        return arrival - planned
+
+
+class TripCache:
+    """Trips by id, kept until they ended.
+
+    Only the planned times are kept: the current delay comes with every
+    departures poll anyway, so a trip never has to be fetched twice.
+    """
+
+    def __init__(self, hass: HomeAssistant) -> None:
+        self.hass = hass
+        self.trips: dict[str, Trip] = {}
+        self.pending: dict[str, asyncio.Task] = {}
+        self.fetcher: Fetcher = async_get_fetcher(hass)
+        self.endpoints: EndpointPool = async_get_endpoints(hass)
+        self.requests = 0
+
+    def get(self, trip_id: str) -> Trip | None:
+        return self.trips.get(trip_id)
+
+    def prune(self) -> None:
+        expired = dt_util.utcnow() - TRIP_GRACE
+        for trip_id in [t for t, trip in self.trips.items() if trip.ends < expired]:
+            del self.trips[trip_id]
+
+    async def async_resolve(self, trip_ids: Iterable[str]) -> None:
+        """Fetch the trips that aren't known yet, each only once even if
+        several sensors ask for it at the same time"""
+        self.prune()
+        tasks = []
+        for trip_id in trip_ids:
+            if trip_id in self.trips:
+                continue
+            if trip_id not in self.pending:
+                self.pending[trip_id] = self.hass.async_create_task(
+                    self.fetch_trip(trip_id)
+                )
+            tasks.append(self.pending[trip_id])
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def fetch_trip(self, trip_id: str) -> None:
+        try:
+            trip = await self.request_trip(trip_id)
+        finally:
+            self.pending.pop(trip_id, None)
+        if trip is not None:
+            self.trips[trip_id] = trip
+
+    async def request_trip(self, trip_id: str) -> Trip | None:
+        timeout = ClientTimeout(total=API_TIMEOUT)
+        for endpoint in self.endpoints.candidates():
+            started = time.monotonic()
+            try:
+                async with self.fetcher.get(
+                    f"{endpoint.url}/trips/{quote(trip_id, safe='')}",
+                    params=TRIP_PARAMS,
+                    timeout=timeout,
+                ) as response:
+                    self.requests += 1
+                    response.raise_for_status()
+                    trip = Trip.from_dict(trip_id, json.loads(await response.read()))
+            except BackingOff as ex:
+                _LOGGER.debug("Trip skipped: %s", ex)
+                continue
+            except ClientResponseError as ex:
+                if ex.status < 500 and ex.status != 429:
+                    # unknown trip, remember that it leads nowhere
+                    _LOGGER.debug("Trip %s not found: %s", trip_id, ex)
+                    return Trip(trip_id, {}, dt_util.utcnow())
+                endpoint.failed(f"trip: {ex.status} {ex.message}")
+                continue
+            except (ClientError, asyncio.TimeoutError) as ex:
+                _LOGGER.debug("Trip error: %s", ex)
+                endpoint.failed(f"trip: {str(ex) or type(ex).__name__}")
+                continue
+            except (ValueError, KeyError, TypeError, AttributeError) as ex:
+                _LOGGER.warning(f"Trip invalid JSON: {ex}")
+                return None
+            endpoint.succeeded(time.monotonic() - started)
+            return trip
+        return None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "trips": len(self.trips),
+            "pending": len(self.pending),
+            "requests": self.requests,
+        }
@@ -0,0 +1,42 @@
+"""Build the timetable file from a GTFS feed ahead of time.
+
+Home Assistant builds it in the background when the feed is newer than the
+timetable, which takes several minutes for the full VBB feed. Building it
+on another machine and copying both files skips that:
+
+    python scripts/build_timetable.py GTFS.zip timetable.bin
+    cp GTFS.zip timetable.bin <config>/berlin_transport/
+"""
+
+from __future__ import annotations
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "custom_components"))
+
+from berlin_transport.gtfs import (  # noqa: E402 pylint: disable=wrong-import-position
+    GtfsFeed,
+    Timetable,
+    build_timetable,
+)
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        sys.exit(f"usage: {sys.argv[0]} <GTFS.zip> <timetable.bin>")
+    feed_path, path = sys.argv[1:]
+    started = time.monotonic()
+    build_timetable(GtfsFeed(feed_path), path + ".tmp")
+    os.replace(path + ".tmp", path)
+    timetable = Timetable(path)
+    print(
+        f"{path}: {len(timetable.stop_ids)} stops, {len(timetable.times)} "
+        f"stop times, {len(timetable.trip_routes)} trips, "
+        f"{os.path.getsize(path) / 2**20:.1f} MiB in {time.monotonic() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
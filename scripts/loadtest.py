@@ -0,0 +1,485 @@
+"""Load test: many sensors on many stops against a local fake transport.rest.
+
+Run from the repository root in an environment with Home Assistant installed:
+
+    python scripts/loadtest.py --sensors 60 --stops 15 --days 1
+
+A simulated day of 60 sensors takes about 3 minutes, of 200 sensors on 40
+stops about 12. --rounds 96 runs a tenth of the poll rounds for a quick look.
+
+The fake API runs in its own thread and serves the benchmark payloads (see
+tests/payloads.py) with the configured latency, share of 503 errors and
+share of 429 answers. Sensors get a mix of directions, line and transport
+type filters, leave-by destinations and vehicle positions.
+
+Time is compressed: a simulated day is one poll round per SCAN_INTERVAL
+(960 rounds), in every round all stops refresh at once, which is the worst
+case for the request queue. Backoff, rate limit pauses, circuit breakers and
+cache freshness run on a virtual clock that skips the rest of SCAN_INTERVAL
+after every round, so they last as many rounds as they would in real time.
+Reported per simulated day: upstream requests, p50/p99 of the refresh of a
+stop (request, parsing and the update of its sensors), failed refreshes, the
+peak number of executor threads, the resident memory and the number of
+Python objects. With --top, allocations are traced (which slows everything down)
+and the largest allocation sites of the integration are listed at the end.
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import gc
+import logging
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "custom_components"))
+
+# pylint: disable=wrong-import-position
+from berlin_transport import cache, endpoints, fetcher  # noqa: E402
+from berlin_transport.const import (  # noqa: E402
+    CONF_ENDPOINTS,
+    DATA_FETCHER,
+    DOMAIN,
+    SCAN_INTERVAL,
+)
+from tests.payloads import load_payload, rebase  # noqa: E402
+
+DESTINATION = "900000100003"
+# the executor Home Assistant's runner installs, the bare HomeAssistant()
+# of this script would use asyncio's default one
+EXECUTOR_PREFIX = "SyncWorker"
+EXECUTOR_WORKERS = 64
+# names of recorded payloads and of generated ones (L0 to L11)
+LINES = ["S5", "U2", "M10", "N*", "L1", "L2", "L1?", "/^L[4-6]$/", "/^X\\d+$/"]
+
+
+class FakeApi:
+    """transport.rest in a thread of its own, so serving the responses
+    doesn't take time from the event loop of Home Assistant"""
+
+    def __init__(self, latency: float, errors: float, rate_limited: float) -> None:
+        self.latency = latency
+        self.errors = errors
+        self.rate_limited = rate_limited
+        self.requests: Counter[str] = Counter()
+        self.payload = load_payload(100)
+        self.body = b""
+        self.body_minute: datetime | None = None
+        self.planned: dict[str, datetime] = {}
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.url = ""
+        self.thread = threading.Thread(target=self.run, name="FakeApi", daemon=True)
+
+    def start(self) -> str:
+        self.thread.start()
+        self.ready.wait()
+        return self.url
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    def run(self) -> None:
+        # pylint: disable=import-outside-toplevel
+        from aiohttp import web
+
+        asyncio.set_event_loop(self.loop)
+        app = web.Application()
+        app.router.add_get("/stops/{stop_id}/departures", self.departures)
+        app.router.add_get("/trips/{trip_id}", self.trip)
+        app.router.add_get("/radar", self.radar)
+        app.router.add_get("/locations", self.locations)
+        runner = web.AppRunner(app, access_log=None)
+        self.loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self.loop.run_until_complete(site.start())
+        port = runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}"
+        self.ready.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(runner.cleanup())
+
+    async def answer(self, route: str):
+        """Error response for this request, None to answer it"""
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        self.requests[route] += 1
+        await asyncio.sleep(self.latency * random.uniform(0.5, 1.5))
+        draw = random.random()
+        if draw < self.rate_limited:
+            self.requests["429"] += 1
+            return web.Response(status=429, headers={"Retry-After": "1"})
+        if draw < self.rate_limited + self.errors:
+            self.requests["503"] += 1
+            return web.Response(status=503)
+        return None
+
+    def current_body(self) -> bytes:
+        """The payload moved to the current minute, serialized once a minute"""
+        minute = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+        if minute != self.body_minute:
+            import json  # pylint: disable=import-outside-toplevel
+
+            payload = rebase(self.payload, minute + timedelta(minutes=2))
+            for departure in payload["departures"]:
+                # the radar needs the coordinates of the stop
+                stop = departure.get("stop") or {}
+                departure["stop"] = {
+                    "location": {"latitude": 52.52, "longitude": 13.41},
+                    **stop,
+                }
+            self.planned = {
+                d["tripId"]: datetime.fromisoformat(d.get("plannedWhen") or d["when"])
+                for d in payload["departures"]
+                if d.get("plannedWhen") or d.get("when")
+            }
+            self.body = json.dumps(payload).encode()
+            self.body_minute = minute
+        return self.body
+
+    async def departures(self, _):
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        error = await self.answer("departures")
+        if error is not None:
+            return error
+        return web.Response(body=self.current_body(), content_type="application/json")
+
+    async def trip(self, request):
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        error = await self.answer("trips")
+        if error is not None:
+            return error
+        self.current_body()
+        trip_id = request.match_info["trip_id"]
+        planned = self.planned.get(trip_id)
+        if planned is None:
+            return web.Response(status=404)
+        stopovers = [{"stop": {"id": "1"}, "plannedDeparture": planned.isoformat()}]
+        # every other trip goes to the destination
+        if zlib.crc32(trip_id.encode()) % 2:
+            arrival = planned + timedelta(minutes=12)
+            stopovers.append(
+                {"stop": {"id": DESTINATION}, "plannedArrival": arrival.isoformat()}
+            )
+        return web.json_response(
+            {"trip": {"id": trip_id, "stopovers": stopovers}},
+        )
+
+    async def radar(self, _):
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        error = await self.answer("radar")
+        if error is not None:
+            return error
+        self.current_body()
+        return web.json_response(
+            {
+                "movements": [
+                    {
+                        "tripId": trip_id,
+                        "location": {
+                            "latitude": 52.52 + random.uniform(-0.01, 0.01),
+                            "longitude": 13.41 + random.uniform(-0.01, 0.01),
+                        },
+                    }
+                    for trip_id in self.planned
+                ]
+            }
+        )
+
+    async def locations(self, _):
+        from aiohttp import web  # pylint: disable=import-outside-toplevel
+
+        return web.json_response([])
+
+
+def sensor_config(i: int, stops: int) -> dict:
+    """A mix of what sensors are configured with"""
+    stop_id = 900000000000 + i % stops
+    config = {
+        "name": f"Sensor {i}",
+        "stop_id": stop_id,
+        "walking_time": 1 + i % 7,
+        "duration": [None, 10, 30][i % 3],
+        "suburban": True,
+        "subway": i % 2 == 0,
+        "tram": True,
+        "bus": i % 3 != 0,
+        "ferry": False,
+        "express": False,
+        "regional": i % 4 == 0,
+    }
+    directions = [None, "900000000101", "900000000101,900000000102"][i % 3]
+    if directions:
+        config["direction"] = directions
+        config["partial_results"] = i % 2 == 0
+    if i % 4 == 1:
+        config["excluded_lines"] = ",".join(random.sample(LINES, 2))
+    if i % 5 == 2:
+        config["included_lines"] = ",".join(random.sample(LINES, 3))
+    if i % 10 == 3:
+        config["vehicle_positions"] = True
+    if i % 10 == 7:
+        config["destination"] = int(DESTINATION)
+    return config
+
+
+def executor_threads() -> int:
+    return sum(1 for t in threading.enumerate() if t.name.startswith(EXECUTOR_PREFIX))
+
+
+class VirtualClock:
+    """Real time plus the simulated time skipped between poll rounds"""
+
+    def __init__(self) -> None:
+        self.skipped = 0.0
+
+    def monotonic(self) -> float:
+        return time.monotonic() + self.skipped
+
+    def time(self) -> float:
+        return time.time() + self.skipped
+
+    def advance(self, seconds: float) -> None:
+        self.skipped += max(0.0, seconds)
+
+    def install(self) -> None:
+        """Runs the pauses and expiries of the integration on this clock"""
+        for module in (cache, endpoints, fetcher):
+            setattr(module, "time", self)
+
+
+CLOCK = VirtualClock()
+
+
+def resident_memory() -> int:
+    """Bytes of memory the process currently uses"""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak instead of current usage, still shows growth
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ThreadSampler:
+    """Peak number of executor threads, sampled while the simulation runs"""
+
+    def __init__(self) -> None:
+        self.peak = executor_threads()
+        self.running = True
+        self.task = asyncio.create_task(self.sample())
+
+    async def sample(self) -> None:
+        while self.running:
+            self.peak = max(self.peak, executor_threads())
+            await asyncio.sleep(0.05)
+
+    async def stop(self) -> None:
+        self.running = False
+        await self.task
+
+
+async def setup_sensors(hass, args: argparse.Namespace) -> list:
+    """Departure sensors, and a leave-by sensor for those with a destination"""
+    # pylint: disable=import-outside-toplevel
+    from berlin_transport.sensor import LeaveSensor, create_sensor
+
+    sensors = []
+    for i in range(args.sensors):
+        config = sensor_config(i, args.stops)
+        sensor = create_sensor(hass, config, f"entry_{i}")
+        sensor.entity_id = f"sensor.load_{i}"
+        sensors.append(sensor)
+        if config.get("destination"):
+            leave = LeaveSensor(sensor, config["destination"])
+            leave.hass = hass
+            leave.entity_id = f"sensor.load_{i}_leave"
+            sensors.append(leave)
+    for sensor in sensors:
+        # added without an entity platform, their state is still written
+        await sensor.async_added_to_hass()
+    await hass.async_block_till_done()
+    return sensors
+
+
+async def timed_refresh(coordinator) -> float:
+    started = time.perf_counter()
+    await coordinator.async_refresh()
+    return time.perf_counter() - started
+
+
+async def simulate_day(
+    hass, api: FakeApi, coordinators: list, radar, rounds: int
+) -> tuple[Counter, list[float], int]:
+    """Requests by route, refresh latencies and failed refreshes of a day"""
+    requests_before = Counter(api.requests)
+    latencies: list[float] = []
+    failed = 0
+    for _ in range(rounds):
+        started = time.monotonic()
+        latencies += await asyncio.gather(*(timed_refresh(c) for c in coordinators))
+        failed += sum(1 for c in coordinators if not c.last_update_success)
+        if radar is not None:
+            await radar.async_refresh()
+        # leave-by sensors resolve their trips in tasks of their own
+        await hass.async_block_till_done()
+        CLOCK.advance(SCAN_INTERVAL.total_seconds() - (time.monotonic() - started))
+    return api.requests - requests_before, latencies, failed
+
+
+def memory_usage() -> tuple[int, int]:
+    """Resident memory and the number of live objects, after a collection"""
+    gc.collect()
+    return resident_memory(), len(gc.get_objects())
+
+
+async def simulate(
+    hass, api: FakeApi, sensors: list, args: argparse.Namespace
+) -> list[float]:
+    """Polls all stops for the simulated days, prints a row per day and
+    returns the refresh latencies of the last one"""
+    # pylint: disable=import-outside-toplevel
+    from berlin_transport.radar import async_get_radar
+
+    coordinators = list({id(s.coordinator): s.coordinator for s in sensors}.values())
+    radar = (
+        async_get_radar(hass)
+        if any(getattr(s, "radar", None) for s in sensors)
+        else None
+    )
+    sampler = ThreadSampler()
+    CLOCK.install()
+    rounds = args.rounds or int(timedelta(days=1) / SCAN_INTERVAL)
+    before = memory_usage()
+    latencies: list[float] = []
+
+    print(
+        f"{'day':>4} {'requests':>9} {'429':>6} {'503':>6} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'failed':>7} {'threads':>8} {'RSS MB':>8} {'growth':>7} {'objects':>8}"
+    )
+    for day in range(1, args.days + 1):
+        requests, latencies, failed = await simulate_day(
+            hass, api, coordinators, radar, rounds
+        )
+        after = memory_usage()
+        print(
+            f"{day:>4} {sum(v for k, v in requests.items() if not k.isdigit()):>9} "
+            f"{requests['429']:>6} {requests['503']:>6} "
+            f"{percentile(latencies, 0.5) * 1000:>8.1f} "
+            f"{percentile(latencies, 0.99) * 1000:>8.1f} {failed:>7} {sampler.peak:>8} "
+            f"{after[0] / 2**20:>8.1f} {(after[0] - before[0]) / 2**20:>+7.2f} "
+            f"{after[1] - before[1]:>+8d}"
+        )
+        before = after
+    await sampler.stop()
+    return latencies
+
+
+def print_allocations(top: int) -> None:
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, "*berlin_transport*")]
+    )
+    for stat in snapshot.statistics("lineno")[:top]:
+        print(stat)
+
+
+async def run(args: argparse.Namespace) -> None:
+    # pylint: disable=import-outside-toplevel
+    from homeassistant.core import HomeAssistant
+    from homeassistant.helpers import restore_state
+    from homeassistant.helpers.aiohttp_client import async_get_clientsession
+    from homeassistant.util.executor import InterruptibleThreadPoolExecutor
+
+    from berlin_transport.fetcher import Fetcher
+
+    asyncio.get_running_loop().set_default_executor(
+        InterruptibleThreadPoolExecutor(
+            thread_name_prefix=EXECUTOR_PREFIX, max_workers=EXECUTOR_WORKERS
+        )
+    )
+    api = FakeApi(args.latency / 1000, args.errors, args.rate_limited)
+    url = api.start()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as config_dir:
+        hass = HomeAssistant(config_dir)
+        await restore_state.async_load(hass)
+        hass.data[DOMAIN] = {
+            CONF_ENDPOINTS: [url],
+            # the real rate limit would make a simulated day take a day
+            DATA_FETCHER: Fetcher(
+                async_get_clientsession(hass), rate=args.rate, burst=int(args.rate) + 1
+            ),
+        }
+
+        if args.top:
+            tracemalloc.start()
+        started = time.perf_counter()
+        sensors = await setup_sensors(hass, args)
+        print(
+            f"{args.sensors} sensors ({len(sensors) - args.sensors} leave-by) on "
+            f"{args.stops} stops set up in {time.perf_counter() - started:.1f}s, "
+            f"{sum(api.requests.values())} requests"
+        )
+        latencies = await simulate(hass, api, sensors, args)
+
+        print(
+            "requests by route: "
+            + ", ".join(f"{k} {v}" for k, v in sorted(api.requests.items()))
+            + f"; mean refresh {statistics.mean(latencies) * 1000:.1f} ms"
+        )
+        if args.top:
+            print_allocations(args.top)
+
+        for sensor in sensors:
+            await sensor.async_will_remove_from_hass()
+        await hass.async_stop(force=True)
+    api.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--sensors", type=int, default=60)
+    parser.add_argument("--stops", type=int, default=15)
+    parser.add_argument("--days", type=int, default=1, help="simulated days")
+    parser.add_argument(
+        "--rounds", type=int, help="poll rounds per simulated day (default 960)"
+    )
+    parser.add_argument("--latency", type=float, default=20, help="API latency in ms")
+    parser.add_argument("--errors", type=float, default=0.0, help="share of 503s")
+    parser.add_argument("--rate-limited", type=float, default=0.0, help="share of 429s")
+    parser.add_argument(
+        "--rate", type=float, default=10000, help="requests per second allowed"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--top", type=int, default=0, help="show the N largest allocation sites"
+    )
+    args = parser.parse_args()
+    # HA warns about every sensor added without a platform
+    logging.basicConfig(level=logging.CRITICAL)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
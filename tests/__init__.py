@@ -0,0 +1 @@
+"""Tests of the berlin_transport integration."""
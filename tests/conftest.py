@@ -0,0 +1,171 @@
+"""Fixtures: a bare Home Assistant instance and a local stub of the API."""
+
+from __future__ import annotations
+import asyncio
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable
+
+import pytest_asyncio
+from aiohttp import web
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import restore_state
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "custom_components"))
+
+# pylint: disable=wrong-import-position
+from berlin_transport.const import (  # noqa: E402
+    DOMAIN,
+    CONF_DEPARTURES,
+    CONF_DEPARTURES_NAME,
+    CONF_DEPARTURES_STOP_ID,
+    CONF_ENDPOINTS,
+)
+from berlin_transport.sensor import (  # noqa: E402
+    PLATFORM_SCHEMA,
+    TransportSensor,
+    create_sensor,
+)
+
+from .payloads import SIZES, recorded  # noqa: E402
+
+
+def pytest_report_header() -> str:
+    return "departures payloads: " + ", ".join(
+        f"{results} {'recorded' if recorded(results) else 'generated'}"
+        for results in SIZES
+    )
+
+
+@dataclass
+class StubApi:
+    """Answers like transport.rest, the tests change the answers on the fly"""
+
+    url: str = ""
+    status: int = 200
+    # seconds before answering
+    delay: float = 0
+    # only requests for this direction wait, if set
+    slow_direction: str | None = None
+    # raw body instead of the generated departures
+    body: bytes | None = None
+    departures: int = 5
+    # answers conditional requests with this ETag by 304
+    etag: str | None = None
+    # answer of /locations
+    locations: list[dict] = field(default_factory=list)
+    # query params of the departures requests
+    requests: list[dict[str, str]] = field(default_factory=list)
+    probes: int = 0
+
+    def payload(self) -> dict:
+        now = datetime.now(timezone(timedelta(hours=2))).replace(
+            second=0, microsecond=0
+        )
+        departures = []
+        for i in range(self.departures):
+            when = (now + timedelta(minutes=3 + i)).isoformat()
+            departures.append(
+                {
+                    "tripId": f"trip{i}",
+                    "stop": {"id": "900100003", "name": "S+U Alexanderplatz"},
+                    "when": when,
+                    "plannedWhen": when,
+                    "delay": 0,
+                    "direction": "S+U Hauptbahnhof",
+                    "line": {"name": f"M{i}", "product": "tram"},
+                }
+            )
+        return {"departures": departures}
+
+    async def handle_departures(self, request: web.Request) -> web.Response:
+        self.requests.append(dict(request.query))
+        if self.delay and self.slow_direction in (None, request.query.get("direction")):
+            await asyncio.sleep(self.delay)
+        if self.status != 200:
+            return web.Response(status=self.status)
+        if self.body is not None:
+            return web.Response(body=self.body, content_type="application/json")
+        if self.etag is None:
+            return web.json_response(self.payload())
+        headers = {"ETag": self.etag, "Cache-Control": "max-age=30"}
+        if request.headers.get("If-None-Match") == self.etag:
+            return web.Response(status=304, headers=headers)
+        return web.json_response(self.payload(), headers=headers)
+
+    async def handle_locations(self, _: web.Request) -> web.Response:
+        self.probes += 1
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response(self.locations)
+
+
+async def add_sensor(hass: HomeAssistant, **config) -> TransportSensor:
+    """A sensor configured like in configuration.yaml, added to HA"""
+    config = PLATFORM_SCHEMA(
+        {
+            "platform": DOMAIN,
+            CONF_DEPARTURES: [
+                {
+                    CONF_DEPARTURES_NAME: "Alexanderplatz",
+                    CONF_DEPARTURES_STOP_ID: 900100003,
+                    **config,
+                }
+            ],
+        }
+    )[CONF_DEPARTURES][0]
+    sensor = create_sensor(hass, config)
+    sensor.hass = hass
+    sensor.entity_id = "sensor.alexanderplatz"
+    await sensor.async_added_to_hass()
+    await hass.async_block_till_done()
+    return sensor
+
+
+async def serve(stub: StubApi, host: str = "127.0.0.1") -> web.AppRunner:
+    """Serves the stub on a free port, reachable under the given host name"""
+    app = web.Application()
+    app.router.add_get("/stops/{stop_id}/departures", stub.handle_departures)
+    app.router.add_get("/locations", stub.handle_locations)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    stub.url = f"http://{host}:{runner.addresses[0][1]}"
+    return runner
+
+
+@pytest_asyncio.fixture(name="hass")
+async def hass_fixture(tmp_path) -> AsyncIterator[HomeAssistant]:
+    hass = HomeAssistant(str(tmp_path))
+    # sensors restore their board on startup
+    await restore_state.async_load(hass)
+    yield hass
+    await hass.async_stop(force=True)
+
+
+@pytest_asyncio.fixture(name="start_api")
+async def start_api_fixture() -> AsyncIterator[Callable[[str], Awaitable[StubApi]]]:
+    """Starts stub APIs, reachable under the given host name"""
+    runners = []
+
+    async def start(host: str = "127.0.0.1") -> StubApi:
+        stub = StubApi()
+        runners.append(await serve(stub, host))
+        return stub
+
+    yield start
+    for runner in runners:
+        await runner.cleanup()
+
+
+@pytest_asyncio.fixture(name="api")
+async def api_fixture(
+    hass: HomeAssistant, start_api: Callable[[str], Awaitable[StubApi]]
+) -> StubApi:
+    """One stub API the integration uses instead of transport.rest"""
+    stub = await start_api("127.0.0.1")
+    hass.data.setdefault(DOMAIN, {})[CONF_ENDPOINTS] = [stub.url]
+    return stub
@@ -0,0 +1,131 @@
+"""Departures responses of transport.rest for the benchmarks and the load test.
+
+Recorded responses are read from tests/fixtures, they are generated when
+there are none. To record the responses of a big station (Hauptbahnhof) for
+15, 100 and 500 results, with the default and the lean query params:
+
+    python tests/payloads.py 900003201
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "custom_components"))
+
+# pylint: disable=wrong-import-position
+from berlin_transport.const import API_ENDPOINT, API_LEAN_PARAMS  # noqa: E402
+from berlin_transport.departure import parse_time  # noqa: E402
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+SIZES = (15, 100, 500)
+PRODUCTS = ["suburban", "subway", "tram", "bus", "regional"]
+
+
+def fixture_path(results: int, lean: bool = False) -> Path:
+    return FIXTURES / f"departures_{results}{'_lean' if lean else ''}.json"
+
+
+def recorded(results: int) -> bool:
+    return fixture_path(results).exists()
+
+
+def make_payload(results: int, seed: int = 0) -> dict:
+    """Departures response of transport.rest with the given number of results"""
+    start = datetime(2024, 5, 6, 8, 0, tzinfo=timezone(timedelta(hours=2)))
+    departures = []
+    for i in range(results):
+        planned = start + timedelta(seconds=40 * i)
+        delay = 60 * ((i + seed) % 4)
+        departures.append(
+            {
+                "tripId": f"1|{10000 + i}|0|86|6052024",
+                "stop": {
+                    "type": "stop",
+                    "id": f"90000010000{i % 3}",
+                    "name": "S+U Hauptbahnhof",
+                },
+                "when": (planned + timedelta(seconds=delay)).isoformat(),
+                "plannedWhen": planned.isoformat(),
+                "delay": delay,
+                "direction": f"Destination {i % 7}",
+                "line": {
+                    "type": "line",
+                    "name": f"L{i % 12}",
+                    "product": PRODUCTS[i % len(PRODUCTS)],
+                    "color": {"fg": "#fff", "bg": "#008d4f"},
+                },
+                "remarks": [{"type": "hint", "code": "bf", "text": "barrier-free"}],
+                "currentTripPosition": {
+                    "type": "location",
+                    "latitude": 52.52,
+                    "longitude": 13.37,
+                },
+                "cancelled": False,
+            }
+        )
+    return {"departures": departures}
+
+
+def load_payload(results: int) -> dict:
+    """Recorded payload with this number of results, generated if there is none"""
+    if recorded(results):
+        return json.loads(fixture_path(results).read_text(encoding="utf-8"))
+    return make_payload(results)
+
+
+def rebase(payload: dict, start: datetime) -> dict:
+    """Copy of the payload with its first departure at `start`"""
+    departures = payload["departures"]
+    first = min(
+        parse_time(d.get("plannedWhen") or d["when"])
+        for d in departures
+        if d.get("plannedWhen") or d.get("when")
+    )
+    shift = start - first
+    rebased = []
+    for departure in departures:
+        departure = dict(departure)
+        for key in ("when", "plannedWhen"):
+            if departure.get(key):
+                departure[key] = (parse_time(departure[key]) + shift).isoformat()
+        rebased.append(departure)
+    return {**payload, "departures": rebased}
+
+
+def record(stop_id: int) -> None:
+    """Saves the responses as they came, so their sizes are the real ones"""
+    import requests  # pylint: disable=import-outside-toplevel
+
+    FIXTURES.mkdir(exist_ok=True)
+    for results in SIZES:
+        for lean in (False, True):
+            response = requests.get(
+                f"{API_ENDPOINT}/stops/{stop_id}/departures",
+                params={
+                    "results": results,
+                    "duration": 24 * 60,
+                    **(API_LEAN_PARAMS if lean else {}),
+                },
+                timeout=30,
+            )
+            response.raise_for_status()
+            path = fixture_path(results, lean)
+            path.write_bytes(response.content)
+            print(
+                f"{path}: {len(response.json()['departures'])} departures, "
+                f"{len(response.content)} bytes"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("stop_id", type=int, nargs="?", default=900003201)
+    record(parser.parse_args().stop_id)
+
+
+if __name__ == "__main__":
+    main()
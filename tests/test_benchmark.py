@@ -0,0 +1,171 @@
+"""Benchmarks of the hot paths against responses of transport.rest.
+
+They need pytest-benchmark and use the recorded responses in tests/fixtures,
+generated ones if there are none (see tests/payloads.py, the header of the
+test run says which). To compare a change with the saved baseline:
+
+    pytest tests/test_benchmark.py --benchmark-storage=tests/benchmarks \\
+        --benchmark-compare --benchmark-compare-fail=median:25%
+
+The baseline only holds for the machine and the payloads it was saved
+with, save one of your own before the change with --benchmark-save=baseline.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers import restore_state
+
+from berlin_transport.const import CONF_ENDPOINTS, DOMAIN
+from berlin_transport.departure import Departure
+from berlin_transport.sensor import TransportSensor
+
+from .conftest import StubApi, add_sensor, serve
+from .payloads import SIZES, fixture_path, load_payload, rebase, recorded
+
+pytest.importorskip("pytest_benchmark")
+
+# every direction returns the same stop events, like the Ringbahn does
+DIRECTIONS = 4
+
+
+class LegacyDeparture(Departure):
+    """Departure with the hashing, equality and attributes it used to have"""
+
+    def to_dict(self, show_api_line_colors: bool, walking_time: int):
+        # the attributes weren't cached, every call built them again
+        object.__setattr__(self, "attributes", None)
+        return super().to_dict(show_api_line_colors, walking_time)
+
+    def __hash__(self):
+        # hash of the displayed fields, rebuilt on every call
+        items = self.to_dict(show_api_line_colors=False, walking_time=0).items()
+        return hash(tuple(sorted(items)))
+
+    def __eq__(self, other):
+        # generated by @dataclass: all fields, including the location list
+        return (
+            self.trip_id,
+            self.line_name,
+            self.line_type,
+            self.timestamp,
+            self.time,
+            self.direction,
+            self.icon,
+            self.bg_color,
+            self.fallback_color,
+            self.location,
+            self.cancelled,
+            self.delay,
+        ) == (
+            other.trip_id,
+            other.line_name,
+            other.line_type,
+            other.timestamp,
+            other.time,
+            other.direction,
+            other.icon,
+            other.bg_color,
+            other.fallback_color,
+            other.location,
+            other.cancelled,
+            other.delay,
+        )
+
+
+@pytest.fixture(name="sensor", params=SIZES)
+def sensor_fixture(
+    request: pytest.FixtureRequest, tmp_path: Path
+) -> Iterator[TransportSensor]:
+    """A sensor of two directions against a stub API answering with the
+    payload. It runs in an event loop of its own, pytest-benchmark only
+    times synchronous calls."""
+    payload = rebase(
+        load_payload(request.param), datetime.now(timezone.utc) + timedelta(minutes=2)
+    )
+    stub = StubApi(body=json.dumps(payload).encode())
+    loop = asyncio.new_event_loop()
+
+    async def start() -> tuple[Any, TransportSensor]:
+        runner = await serve(stub)
+        hass = HomeAssistant(str(tmp_path))
+        hass.data[DOMAIN] = {CONF_ENDPOINTS: [stub.url]}
+        await restore_state.async_load(hass)
+        sensor = await add_sensor(
+            hass, direction="900000000001,900000000002", duration=24 * 60
+        )
+        return runner, sensor
+
+    runner, sensor = loop.run_until_complete(start())
+    assert sensor.departures, "the sensor shows no departures"
+    yield sensor
+    loop.run_until_complete(sensor.hass.async_stop(force=True))
+    loop.run_until_complete(runner.cleanup())
+    loop.close()
+
+
+@pytest.mark.parametrize("results", SIZES)
+def test_from_dict(benchmark, results: int) -> None:
+    payload = load_payload(results)["departures"]
+
+    departures = benchmark(lambda: [Departure.from_dict(d) for d in payload])
+
+    assert len(departures) == len(payload)
+
+
+@pytest.mark.parametrize("results", SIZES)
+@pytest.mark.parametrize("cls", [LegacyDeparture, Departure], ids=["legacy", "key"])
+def test_dedup(benchmark, results: int, cls: type[Departure]) -> None:
+    payload = load_payload(results)["departures"]
+    departures = [cls.from_dict(d) for _ in range(DIRECTIONS) for d in payload]
+
+    unique = benchmark(lambda: set(departures))
+
+    assert len(unique) <= len(payload)
+
+
+def test_filter_departures(benchmark, sensor: TransportSensor) -> None:
+    data = sensor.coordinator.data
+
+    departures = benchmark(lambda: sensor.filter_departures(data))
+
+    assert departures
+
+
+def test_extra_state_attributes(benchmark, sensor: TransportSensor) -> None:
+    attributes = benchmark(lambda: sensor.extra_state_attributes)
+
+    assert attributes["departures"]
+
+
+def test_update_cycle(benchmark, sensor: TransportSensor) -> None:
+    """Request, parsing and the update of the sensor"""
+    hass = sensor.hass
+
+    async def cycle() -> None:
+        # the stub sends no cache headers, every cycle fetches and parses
+        await sensor.coordinator.async_refresh()
+        await hass.async_block_till_done()
+
+    benchmark.pedantic(lambda: hass.loop.run_until_complete(cycle()), rounds=20)
+
+    assert sensor.coordinator.last_update_success
+
+
+@pytest.mark.parametrize("results", SIZES)
+def test_lean_response(results: int) -> None:
+    """The lean query params make the recorded response smaller"""
+    if not recorded(results) or not fixture_path(results, lean=True).exists():
+        pytest.skip("needs recorded responses, see tests/payloads.py")
+    full = fixture_path(results).read_bytes()
+    lean = fixture_path(results, lean=True).read_bytes()
+
+    assert len(json.loads(lean)["departures"]) == len(json.loads(full)["departures"])
+    assert len(lean) < len(full)
@@ -0,0 +1,64 @@
+"""Response cache and conditional requests."""
+
+from __future__ import annotations
+import asyncio
+import time
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport.cache import ResponseCache, async_get_cache
+
+from .conftest import StubApi, add_sensor
+
+
+def test_hit_after_eviction() -> None:
+    cache = ResponseCache()
+    cache.store("key", ["departure"], {"ETag": '"1"'}, size=100)
+    entry = cache.get("key")
+    assert entry is not None and not entry.is_fresh()
+    # evicted while the conditional request was in flight
+    cache.remove("key")
+
+    assert cache.hit(entry, {"Cache-Control": "max-age=30"}) == ["departure"]
+    assert entry.fresh_until > time.monotonic()
+    assert cache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_not_modified(hass: HomeAssistant, api: StubApi) -> None:
+    api.etag = '"1"'
+    sensor = await add_sensor(hass)
+    departures = sensor.departures
+    cache = async_get_cache(hass)
+    # revalidate instead of using the fresh entry
+    for entry in cache.entries.values():
+        entry.fresh_until = 0
+    await sensor.coordinator.async_refresh()
+
+    assert len(api.requests) == 2
+    assert cache.hits == 1
+    assert sensor.available
+    assert sensor.departures == departures
+
+
+@pytest.mark.asyncio
+async def test_not_modified_after_eviction(hass: HomeAssistant, api: StubApi) -> None:
+    api.etag = '"1"'
+    sensor = await add_sensor(hass)
+    cache = async_get_cache(hass)
+    for entry in cache.entries.values():
+        entry.fresh_until = 0
+    # the entry is evicted while the request is in flight
+    api.delay = 0.1
+    refresh = hass.async_create_task(sensor.coordinator.async_refresh())
+    while len(api.requests) < 2:
+        await asyncio.sleep(0.01)
+    for key in list(cache.entries):
+        cache.remove(key)
+    await refresh
+
+    assert sensor.coordinator.last_update_success
+    assert sensor.coordinator.metrics.direction(None).last_error is None
+    assert len(sensor.departures) == 5
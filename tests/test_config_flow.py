@@ -0,0 +1,95 @@
+"""Stop search of the config flow."""
+
+from __future__ import annotations
+import os
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport import gtfs
+from berlin_transport.config_flow import TransportConfigFlowHandler
+from berlin_transport.const import DOMAIN, GTFS_FEED
+
+from .conftest import StubApi
+
+ALEXANDERPLATZ = {"type": "stop", "id": "900100003", "name": "S+U Alexanderplatz"}
+
+
+@pytest.mark.asyncio
+async def test_broken_feed_falls_back_to_api(
+    hass: HomeAssistant, api: StubApi, caplog: pytest.LogCaptureFixture
+) -> None:
+    api.locations = [ALEXANDERPLATZ, {"type": "location", "name": "Alexanderstr."}]
+    os.makedirs(hass.config.path(DOMAIN))
+    with open(hass.config.path(DOMAIN, GTFS_FEED), "wb") as file:
+        file.write(b"PK\x03\x04 not really a zip")
+    flow = TransportConfigFlowHandler()
+    flow.hass = hass
+
+    stops = await flow.async_search_stops("Alexanderplatz")
+
+    assert "Failed to load the stop index" in caplog.text
+    assert stops == [{"name": "S+U Alexanderplatz", "stop_id": "900100003"}]
+
+
+def test_index_is_replaced_at_once(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    feed = tmp_path / "feed"
+    feed.mkdir()
+    (feed / "stops.txt").write_text(
+        "stop_id,stop_name,stop_lat,stop_lon\n"
+        "de:11000:900100003::1,S+U Alexanderplatz,52.5219,13.4132\n",
+        encoding="utf-8",
+    )
+    index_path = tmp_path / "stops.json"
+    index_path.write_text("[]", encoding="utf-8")
+    os.utime(index_path, (0, 0))
+    written = []
+    replace = os.replace
+
+    def record(src: str, dst: str) -> None:
+        # the old index is still complete while the new one is written
+        written.append((src, dst, index_path.read_text(encoding="utf-8")))
+        replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", record)
+    stop_index = gtfs.load_stop_index(str(feed), str(index_path))
+
+    assert stop_index is not None
+    assert [stop.id for stop in stop_index.search("alex", 5)] == ["900100003"]
+    assert written == [(f"{index_path}.tmp", str(index_path), "[]")]
+
+
+def test_index_reads_only_the_stops(tmp_path) -> None:
+    feed = tmp_path / "feed"
+    feed.mkdir()
+    (feed / "stops.txt").write_text(
+        "stop_id,stop_name,stop_lat,stop_lon,parent_station\n"
+        "de:11000:900100003,S+U Alexanderplatz,52.5219,13.4132,\n"
+        "de:11000:900100003::1,S+U Alexanderplatz,52.5219,13.4132,"
+        "de:11000:900100003\n",
+        encoding="utf-8",
+    )
+    # the stop times of the full feed would take minutes to read
+    (feed / "stop_times.txt").write_bytes(b"\xff not even text")
+    stop_index = gtfs.load_stop_index(str(feed), str(tmp_path / "stops.json"))
+
+    assert stop_index is not None
+    assert stop_index.stops == [
+        gtfs.Stop("900100003", "S+U Alexanderplatz", 52.5219, 13.4132)
+    ]
+
+
+def test_index_of_older_versions(tmp_path) -> None:
+    feed = tmp_path / "feed"
+    feed.mkdir()
+    (feed / "stops.txt").write_text("stop_id,stop_name,stop_lat,stop_lon\n")
+    index_path = tmp_path / "stops.json"
+    index_path.write_text(
+        '[["900100003", "S+U Alexanderplatz", 52.5219, 13.4132, ["subway"]]]',
+        encoding="utf-8",
+    )
+    stop_index = gtfs.load_stop_index(str(feed), str(index_path))
+
+    assert stop_index is not None
+    assert [stop.id for stop in stop_index.search("alex", 5)] == ["900100003"]
@@ -0,0 +1,143 @@
+"""Departures sensor against the stub API."""
+
+from __future__ import annotations
+from datetime import timedelta
+
+import pytest
+import voluptuous as vol
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport import coordinator
+from berlin_transport.const import API_MAX_RESULTS, FALLBACK_TIME, SCAN_INTERVAL
+from berlin_transport.sensor import TransportSensor
+
+from .conftest import StubApi, add_sensor
+
+
+def last_error(sensor: TransportSensor) -> str | None:
+    return sensor.coordinator.metrics.direction(None).last_error
+
+
+@pytest.mark.asyncio
+async def test_departures(hass: HomeAssistant, api: StubApi) -> None:
+    sensor = await add_sensor(hass)
+
+    assert sensor.available
+    assert len(sensor.departures) == 5
+    assert sensor.state.startswith("Next M0 at ")
+    assert hass.states.get("sensor.alexanderplatz").state == sensor.state
+    # params are sent the way the API expects them
+    assert len(api.requests) == 1
+    assert api.requests[0]["results"] == "15"
+    assert api.requests[0]["remarks"] == "false"
+    assert "when" in api.requests[0]
+
+
+@pytest.mark.asyncio
+async def test_board_size(hass: HomeAssistant, api: StubApi) -> None:
+    # two sensors with different filters, the query asks for results of both
+    api.departures = 40
+    sensor = await add_sensor(hass, duration=60)
+    await add_sensor(hass, name="Trams", duration=60, excluded_lines="M1")
+    await sensor.coordinator.async_refresh()
+
+    assert api.requests[-1]["results"] == str(2 * API_MAX_RESULTS)
+    assert len(sensor.departures) == API_MAX_RESULTS
+    assert sensor.departures[0].line_name == "M0"
+
+
+@pytest.mark.asyncio
+async def test_http_error(hass: HomeAssistant, api: StubApi) -> None:
+    api.status = 503
+    sensor = await add_sensor(hass)
+
+    assert not sensor.available
+    assert sensor.departures == []
+    assert last_error(sensor) == "503 Service Unavailable"
+
+
+@pytest.mark.asyncio
+async def test_timeout(
+    hass: HomeAssistant, api: StubApi, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(coordinator, "API_TIMEOUT", 0.2)
+    monkeypatch.setattr(coordinator, "API_MIN_TIMEOUT", 0.2)
+    api.delay = 1
+    sensor = await add_sensor(hass)
+
+    assert not sensor.available
+    assert last_error(sensor) == "timeout"
+
+
+@pytest.mark.asyncio
+async def test_slow_direction(
+    hass: HomeAssistant, api: StubApi, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # the shared deadline expires before the request times out on its own
+    monkeypatch.setattr(coordinator, "API_TIMEOUT", 0.2)
+    monkeypatch.setattr(coordinator, "API_MIN_TIMEOUT", 5)
+    api.delay = 1
+    api.slow_direction = "900100002"
+    sensor = await add_sensor(
+        hass, direction="900100001,900100002", partial_results=True
+    )
+
+    assert sensor.coordinator.last_exception is None
+    assert sensor.available
+    assert len(sensor.departures) == 5
+    metrics = sensor.coordinator.metrics
+    assert metrics.direction("900100002").last_error == "timeout"
+    assert metrics.direction("900100001").last_error is None
+
+
+@pytest.mark.asyncio
+async def test_invalid_json(hass: HomeAssistant, api: StubApi) -> None:
+    api.body = b'{"departures": [{"tripId": '
+    sensor = await add_sensor(hass)
+
+    assert not sensor.available
+    assert (last_error(sensor) or "").startswith("invalid JSON")
+
+
+@pytest.mark.asyncio
+async def test_recent_board_survives_errors(hass: HomeAssistant, api: StubApi) -> None:
+    sensor = await add_sensor(hass)
+    api.status = 503
+    await sensor.coordinator.async_refresh()
+
+    assert not sensor.coordinator.last_update_success
+    assert sensor.available
+    assert len(sensor.departures) == 5
+
+
+@pytest.mark.asyncio
+async def test_board_expires_after_fallback_time(
+    hass: HomeAssistant, api: StubApi
+) -> None:
+    sensor = await add_sensor(hass)
+    assert sensor.last_update_success is not None
+    sensor.last_update_success -= FALLBACK_TIME + timedelta(minutes=1)
+    api.status = 503
+    await sensor.coordinator.async_refresh()
+
+    assert not sensor.available
+    assert sensor.departures == []
+
+
+@pytest.mark.asyncio
+async def test_polling_interval(hass: HomeAssistant, api: StubApi) -> None:
+    # the next departure leaves in 3 minutes, still no faster than SCAN_INTERVAL
+    sensor = await add_sensor(hass)
+
+    assert sensor.coordinator.interval == SCAN_INTERVAL
+    assert sensor.extra_state_attributes["update_interval"] == 90
+
+    faster = await add_sensor(hass, min_scan_interval=30)
+    assert faster.coordinator is sensor.coordinator
+    await sensor.coordinator.async_refresh()
+    assert sensor.coordinator.interval == timedelta(seconds=30)
+    assert len(api.requests) == 2
+
+    with pytest.raises(vol.Invalid):
+        await add_sensor(hass, min_scan_interval=5)
@@ -0,0 +1,136 @@
+"""Failover and circuit breaking between two stub APIs."""
+
+from __future__ import annotations
+import asyncio
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+import pytest
+import pytest_asyncio
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport import endpoints, fetcher
+from berlin_transport.const import (
+    DOMAIN,
+    CIRCUIT_FAILURES,
+    CONF_ENDPOINTS,
+    DATA_COORDINATORS,
+)
+from berlin_transport.endpoints import (
+    EndpointPool,
+    async_get_endpoints,
+)
+
+from .conftest import StubApi, add_sensor
+
+
+@pytest_asyncio.fixture(name="apis")
+async def apis_fixture(
+    hass: HomeAssistant,
+    start_api: Callable[[str], Awaitable[StubApi]],
+    monkeypatch: pytest.MonkeyPatch,
+) -> tuple[StubApi, StubApi]:
+    """A primary and a backup API, on different hosts so they don't share
+    a rate limit"""
+    # every failure reaches the circuit breaker instead of a backing off host
+    monkeypatch.setattr(fetcher, "backoff_delay", lambda failures: 0)
+    primary = await start_api("127.0.0.1")
+    backup = await start_api("localhost")
+    hass.data.setdefault(DOMAIN, {})[CONF_ENDPOINTS] = [primary.url, backup.url]
+    return primary, backup
+
+
+async def open_circuit(hass: HomeAssistant, primary: StubApi) -> EndpointPool:
+    """Fails the primary until its circuit opens"""
+    primary.status = 503
+    sensor = await add_sensor(hass)
+    pool = async_get_endpoints(hass)
+    # the polls go to the backup now, the probes keep trying the primary
+    for _ in range(CIRCUIT_FAILURES):
+        if not pool.endpoints[0].closed:
+            break
+        await pool.async_probe()
+    assert not pool.endpoints[0].closed
+    assert sensor.available
+    return pool
+
+
+@pytest.mark.asyncio
+async def test_failover(hass: HomeAssistant, apis: tuple[StubApi, StubApi]) -> None:
+    primary, backup = apis
+    primary.status = 503
+    sensor = await add_sensor(hass)
+
+    assert sensor.available
+    assert len(sensor.departures) == 5
+    assert len(primary.requests) == 1
+    assert len(backup.requests) == 1
+    assert (
+        async_get_endpoints(hass).endpoints[0].last_error == "503 Service Unavailable"
+    )
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_is_skipped(
+    hass: HomeAssistant, apis: tuple[StubApi, StubApi]
+) -> None:
+    primary, backup = apis
+    pool = await open_circuit(hass, primary)
+    requests = len(primary.requests), len(backup.requests)
+    # even with the backup failing too, the open circuit gets no requests
+    backup.status = 503
+    await hass.data[DOMAIN][DATA_COORDINATORS][900100003].async_refresh()
+    await pool.async_probe()
+
+    assert len(primary.requests) == requests[0]
+    assert len(backup.requests) == requests[1] + 1
+    assert [endpoint.url for endpoint in pool.candidates()] == [backup.url]
+
+
+@pytest.mark.asyncio
+async def test_half_open_recovery(
+    hass: HomeAssistant, apis: tuple[StubApi, StubApi]
+) -> None:
+    primary, _ = apis
+    pool = await open_circuit(hass, primary)
+    # the circuit stays open for CIRCUIT_OPEN_TIME, then allows a trial
+    pool.endpoints[0].opened_until = 0
+    assert pool.endpoints[0].usable
+    primary.status = 200
+    await pool.async_probe()
+
+    assert pool.endpoints[0].closed
+    assert pool.endpoints[0].failures == 0
+    assert pool.endpoints[0].latency is not None
+
+
+@pytest.mark.asyncio
+async def test_half_open_failure_opens_again(
+    hass: HomeAssistant, apis: tuple[StubApi, StubApi]
+) -> None:
+    primary, _ = apis
+    pool = await open_circuit(hass, primary)
+    pool.endpoints[0].opened_until = 0
+    await pool.async_probe()
+
+    assert not pool.endpoints[0].usable
+
+
+@pytest.mark.asyncio
+async def test_shutdown_stops_probes(
+    hass: HomeAssistant,
+    apis: tuple[StubApi, StubApi],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    primary, _ = apis
+    monkeypatch.setattr(endpoints, "PROBE_INTERVAL", timedelta(seconds=0.05))
+    pool = async_get_endpoints(hass)
+    await asyncio.sleep(0.2)
+    assert primary.probes > 1
+
+    pool.async_shutdown()
+    await hass.async_block_till_done()
+    probes = primary.probes
+    await asyncio.sleep(0.2)
+    assert primary.probes == probes
@@ -0,0 +1,101 @@
+"""Line, stop and transport type filters of a sensor."""
+
+from __future__ import annotations
+
+import pytest
+import voluptuous as vol
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport.config_flow import TransportConfigFlowHandler
+from berlin_transport.filters import FilterSpec, LineMatcher, validate_lines
+from berlin_transport.sensor import PLATFORM_SCHEMA
+
+
+def test_names() -> None:
+    matcher = LineMatcher.parse(" M10, U2 ,,")
+
+    assert matcher.names == {"M10", "U2"}
+    assert matcher.matches("M10")
+    assert not matcher.matches("M1")
+    assert not matcher.matches("M100")
+    assert not matcher.matches(None)
+    assert not LineMatcher.parse("")
+
+
+def test_globs_match_the_whole_name() -> None:
+    matcher = LineMatcher.parse("N*,S4?")
+
+    assert matcher.matches("N2")
+    assert matcher.matches("S41")
+    assert not matcher.matches("S4")
+    assert not matcher.matches("S410")
+    # a glob isn't searched for inside the name
+    assert not matcher.matches("SEV N2")
+
+
+def test_regular_expressions() -> None:
+    matcher = LineMatcher.parse(r"/^X\d+$/,/RE/")
+
+    assert matcher.matches("X9")
+    assert not matcher.matches("X9A")
+    # unanchored, they match anywhere in the name
+    assert matcher.matches("FEX RE1")
+    assert not matcher.matches("M10")
+
+
+def test_excluded_lines_win() -> None:
+    spec = FilterSpec.from_config(
+        {
+            "tram": True,
+            "excluded_lines": "M1?",
+            "included_lines": "M*,/^U/",
+        }
+    )
+
+    assert spec.matches_source({"line": {"name": "M4", "product": "tram"}})
+    assert not spec.matches_source({"line": {"name": "M10", "product": "tram"}})
+    assert not spec.matches_source({"line": {"name": "12", "product": "tram"}})
+    # lines of transport types the sensor doesn't show stay hidden
+    assert not spec.matches_source({"line": {"name": "U2", "product": "subway"}})
+
+
+def test_excluded_stops() -> None:
+    spec = FilterSpec.from_config({"bus": True, "excluded_stops": "900100003"})
+
+    assert not spec.allows("900100003", "100", "bus")
+    assert spec.allows("900100004", "100", "bus")
+
+
+def test_invalid_regular_expression() -> None:
+    assert validate_lines("/^M/, N*") == "/^M/, N*"
+    assert validate_lines(None) is None
+    with pytest.raises(vol.Invalid):
+        validate_lines("M10,/[/")
+    with pytest.raises(vol.Invalid):
+        PLATFORM_SCHEMA(
+            {
+                "platform": "berlin_transport",
+                "departures": [
+                    {
+                        "name": "Alexanderplatz",
+                        "stop_id": 900100003,
+                        "excluded_lines": "/[/",
+                    }
+                ],
+            }
+        )
+
+
+@pytest.mark.asyncio
+async def test_invalid_filter_is_a_form_error(hass: HomeAssistant) -> None:
+    flow = TransportConfigFlowHandler()
+    flow.hass = hass
+    flow.data = {"name": "S+U Alexanderplatz", "stop_id": "900100003"}
+
+    result = await flow.async_step_details({"included_lines": "/(M/"})
+    assert result["type"] == "form"
+    assert result["errors"] == {"included_lines": "invalid_lines"}
+
+    result = await flow.async_step_details({"included_lines": "/M\\d+/"})
+    assert result["type"] == "create_entry"
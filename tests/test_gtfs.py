@@ -0,0 +1,142 @@
+"""Timetable built from a small GTFS feed."""
+
+from __future__ import annotations
+import asyncio
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport import gtfs
+from berlin_transport.departure import stop_id_of
+from berlin_transport.gtfs import (
+    GTFS_TIMEZONE,
+    GtfsFeed,
+    Timetable,
+    async_get_timetable,
+    build_timetable,
+)
+
+FEED = {
+    "stops.txt": [
+        "stop_id,stop_name,stop_lat,stop_lon",
+        "de:11000:900110501::1,U Eberswalder Str.,52.5415,13.4122",
+        "de:11000:900100003::1,S+U Alexanderplatz,52.5219,13.4132",
+        "de:11000:900100002::1,S+U Hauptbahnhof,52.5251,13.3694",
+    ],
+    "routes.txt": [
+        "route_id,route_short_name,route_type",
+        "u2,U2,1",
+        "x,,1500",
+    ],
+    "calendar.txt": [
+        "service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,"
+        "start_date,end_date",
+        "daily,1,1,1,1,1,1,1,20000101,20991231",
+    ],
+}
+
+
+@pytest.fixture(name="timetable")
+def timetable_fixture(tmp_path: Path) -> Timetable:
+    """A trip every 10 minutes of the day through three stops"""
+    trips = ["route_id,service_id,trip_id,trip_headsign"]
+    stop_times = ["trip_id,arrival_time,departure_time,stop_id,stop_sequence"]
+    stops = [row.split(",", maxsplit=1)[0] for row in FEED["stops.txt"][1:]]
+    for i in range(24 * 6):
+        trips.append(f"u2,daily,u2-{i},S+U Hauptbahnhof")
+        for sequence, stop in enumerate(stops):
+            seconds = i * 600 + sequence * 120
+            when = f"{seconds // 3600:02}:{seconds // 60 % 60:02}:00"
+            stop_times.append(f"u2-{i},{when},{when},{stop},{sequence}")
+    # a route without a name and of an unknown type, every hour
+    for hour in range(24):
+        trips.append(f"x,daily,x-{hour},")
+        when = f"{hour:02}:05:00"
+        stop_times.append(f"x-{hour},{when},{when},de:11000:900100003::1,0")
+    files = {**FEED, "trips.txt": trips, "stop_times.txt": stop_times}
+    for name, rows in files.items():
+        (tmp_path / name).write_text("\n".join(rows) + "\n", encoding="utf-8")
+    build_timetable(GtfsFeed(str(tmp_path)), str(tmp_path / "timetable.bin"))
+    return Timetable(str(tmp_path / "timetable.bin"))
+
+
+def test_stop_id_of() -> None:
+    assert stop_id_of(900000100003) == "900100003"
+    assert stop_id_of("900000110501") == "900110501"
+    assert stop_id_of(900100003) == "900100003"
+    # other 12 digit ids are left alone
+    assert stop_id_of("900123456789") == "900123456789"
+
+
+def test_departures(timetable: Timetable) -> None:
+    after = datetime.now(timezone.utc)
+    departures = timetable.departures(900110501, after, after + timedelta(hours=1), 5)
+
+    assert len(departures) == 5
+    assert all(d.line_name == "U2" and d.line_type == "subway" for d in departures)
+    assert all(d.direction == "S+U Hauptbahnhof" for d in departures)
+    assert all(after <= d.timestamp <= after + timedelta(hours=1) for d in departures)
+    assert departures == sorted(departures, key=lambda d: d.timestamp)
+
+
+def test_legacy_stop_ids(timetable: Timetable) -> None:
+    after = datetime.now(timezone.utc)
+    until = after + timedelta(hours=1)
+    departures = timetable.departures(900110501, after, until, 5, "900100002")
+
+    assert len(departures) == 5
+    assert timetable.stop_index(900000110501) == timetable.stop_index(900110501)
+    assert [
+        d.timestamp
+        for d in timetable.departures(900000110501, after, until, 5, "900000100002")
+    ] == [d.timestamp for d in departures]
+    # the trips don't go back from the last stop
+    assert not timetable.departures(900100002, after, until, 5, "900000110501")
+
+
+def test_window_past_midnight(timetable: Timetable) -> None:
+    after = datetime(2026, 1, 15, 23, 55, tzinfo=GTFS_TIMEZONE)
+    departures = timetable.departures(
+        900110501, after, after + timedelta(minutes=15), 5
+    )
+
+    assert [d.timestamp for d in departures] == [
+        datetime(2026, 1, 16, 0, 0, tzinfo=GTFS_TIMEZONE),
+        datetime(2026, 1, 16, 0, 10, tzinfo=GTFS_TIMEZONE),
+    ]
+
+
+def test_unknown_route(timetable: Timetable) -> None:
+    after = datetime.now(timezone.utc)
+    departures = timetable.departures(900100003, after, after + timedelta(hours=1), 20)
+
+    unnamed = [d for d in departures if not d.line_name]
+    assert len(unnamed) == 1
+    assert all(d.line_type == "" and d.direction is None for d in unnamed)
+
+
+@pytest.mark.asyncio
+async def test_failed_load_is_retried(
+    hass: HomeAssistant,
+    timetable: Timetable,
+    monkeypatch: pytest.MonkeyPatch,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    def broken(feed_path: str, path: str) -> Timetable:
+        raise OSError(f"{path} is broken")
+
+    monkeypatch.setattr(gtfs, "TIMETABLE_RETRY", timedelta(seconds=0.05))
+    monkeypatch.setattr(gtfs, "load_timetable", broken)
+    assert async_get_timetable(hass) is None
+    await hass.async_block_till_done()
+    assert "Failed to load the timetable" in caplog.text
+    assert async_get_timetable(hass) is None
+
+    monkeypatch.setattr(gtfs, "load_timetable", lambda feed_path, path: timetable)
+    await asyncio.sleep(0.1)
+    assert async_get_timetable(hass) is None
+    await hass.async_block_till_done()
+    assert async_get_timetable(hass) is timetable
@@ -0,0 +1,62 @@
+"""Areas and vehicle lookup of the radar."""
+
+from __future__ import annotations
+
+import pytest
+
+from berlin_transport.radar import Area, Vehicle, VehicleIndex, distance, radar_areas
+
+ALEXANDERPLATZ = (52.5219, 13.4132)
+JANNOWITZBRUECKE = (52.5150, 13.4180)
+COTTBUS = (51.7500, 14.3300)
+
+
+def test_areas_of_nearby_stops_merge() -> None:
+    areas = radar_areas([ALEXANDERPLATZ, JANNOWITZBRUECKE, ALEXANDERPLATZ], 0.02)
+
+    assert areas == [
+        Area.around(ALEXANDERPLATZ, 0.02).union(Area.around(JANNOWITZBRUECKE, 0.02))
+    ]
+
+
+def test_distant_stops_get_an_area_each() -> None:
+    areas = radar_areas([ALEXANDERPLATZ, COTTBUS], 0.02)
+
+    assert len(areas) == 2
+    assert not areas[0].overlaps(areas[1])
+    assert not radar_areas([], 0.02)
+
+
+def test_row_of_stops_is_one_area() -> None:
+    # each box overlaps the next one only, not the first and the last
+    stops = [(52.50, 13.345), (52.50, 13.30), (52.50, 13.33), (52.50, 13.315)]
+    assert not Area.around(stops[0], 0.01).overlaps(Area.around(stops[1], 0.01))
+
+    assert radar_areas(stops, 0.01) == [
+        Area.around(stops[0], 0.01).union(Area.around(stops[1], 0.01))
+    ]
+
+
+def test_nearby_vehicles() -> None:
+    near = Vehicle("1", (52.5230, 13.4140), "M2")
+    # in a neighbouring grid cell, still within the radius
+    across = Vehicle("2", (52.5195, 13.4095), "U2")
+    far = Vehicle("3", (52.5500, 13.4132), "M4")
+    index = VehicleIndex([near, across, far, Vehicle("1", COTTBUS)])
+
+    assert len(index) == 3
+    assert index.cell(across.location) != index.cell(ALEXANDERPLATZ)
+    assert {v.trip_id for v in index.nearby(ALEXANDERPLATZ, 500)} == {"1", "2"}
+    assert {v.trip_id for v in index.nearby(ALEXANDERPLATZ, 5000)} == {"1", "2", "3"}
+    assert not list(index.nearby(COTTBUS, 5000))
+
+
+def test_vehicle_by_trip() -> None:
+    index = VehicleIndex()
+    index.add(Vehicle("1", ALEXANDERPLATZ))
+    # the same trip seen again in an overlapping area keeps its first position
+    index.add(Vehicle("1", COTTBUS))
+
+    assert index.get("1") == Vehicle("1", ALEXANDERPLATZ)
+    assert index.get("2") is None
+    assert distance(ALEXANDERPLATZ, JANNOWITZBRUECKE) == pytest.approx(830, abs=30)
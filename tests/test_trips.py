@@ -0,0 +1,60 @@
+"""Trips and the leave-by sensor."""
+
+from __future__ import annotations
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from homeassistant.core import HomeAssistant
+
+from berlin_transport.departure import Departure, stop_id_of
+from berlin_transport.sensor import LeaveSensor
+from berlin_transport.trips import Trip
+
+from .conftest import StubApi, add_sensor
+
+NOW = datetime.now(timezone.utc).replace(microsecond=0)
+
+
+def stopover(stop_id: str, station_id: str, minutes: int) -> dict:
+    return {
+        "stop": {"id": stop_id, "station": {"id": station_id}},
+        "plannedArrival": (NOW + timedelta(minutes=minutes)).isoformat(),
+    }
+
+
+TRIP = {
+    "trip": {
+        "id": "1|2345|0",
+        "plannedArrival": (NOW + timedelta(minutes=20)).isoformat(),
+        "stopovers": [
+            stopover("900110501", "900110501", 0),
+            stopover("de:11000:900100003::1", "900100003", 10),
+            stopover("900100002", "900100002", 20),
+        ],
+    }
+}
+
+
+def test_travel_time() -> None:
+    trip = Trip.from_dict("1|2345|0", TRIP)
+    departure = Departure("1|2345|0", "900110501", "U2", "subway", NOW)
+
+    assert trip.travel_time(departure, "900100003") == timedelta(minutes=10)
+    assert trip.travel_time(departure, stop_id_of(900000100002)) == timedelta(
+        minutes=20
+    )
+    # the trip doesn't go back to where it started
+    later = Departure(
+        "1|2345|0", "900100003", "U2", "subway", NOW + timedelta(minutes=10)
+    )
+    assert trip.travel_time(later, "900110501") is None
+
+
+@pytest.mark.asyncio
+async def test_old_destination_ids(hass: HomeAssistant, api: StubApi) -> None:
+    sensor = await add_sensor(hass)
+
+    assert api.requests
+    assert LeaveSensor(sensor, 900000100003).destination == "900100003"
+    assert LeaveSensor(sensor, 900100003).destination == "900100003"